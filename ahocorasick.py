@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+import logging
+
+from array import array
+from collections import OrderedDict, deque
+from typing import Dict, Iterable, List, Set
+
+log = logging.getLogger(__name__)
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a set of patterns, finding all of their occurrences in a
+    text in a single pass over it, see Aho & Corasick (1975).
+
+    Every state is a prefix of some pattern. Besides its transitions it has a failure link
+    to the longest proper suffix that is a state too, and a dictionary link to the longest
+    such suffix that is a whole pattern, so that at each position of the text only the
+    patterns that end there are visited.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(OrderedDict.fromkeys(p for p in patterns if p))
+        self.goto = [{}]
+        self.output = array("i", [-1])
+
+        for k, pattern in enumerate(self.patterns):
+            state = 0
+            for c in pattern:
+                if c not in self.goto[state]:
+                    self.goto[state][c] = len(self.goto)
+                    self.goto.append({})
+                    self.output.append(-1)
+                state = self.goto[state][c]
+            self.output[state] = k
+
+        # Breadth first, so the links of shorter prefixes are known before they are needed
+        self.fail = array("i", [0] * len(self.goto))
+        self.dictionary = array("i", [-1] * len(self.goto))
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, to in self.goto[state].items():
+                queue.append(to)
+                link = self.fail[state]
+                while link and c not in self.goto[link]:
+                    link = self.fail[link]
+                link = self.fail[to] = self.goto[link].get(c, 0)
+                self.dictionary[to] = link if self.output[link] >= 0 else self.dictionary[link]
+
+    def __len__(self):
+        return len(self.goto)
+
+    def matches(self, s: str):
+        """(position, pattern number) of every occurrence in s, by ascending end position"""
+        goto, fail, output, dictionary, patterns = self.goto, self.fail, self.output, self.dictionary, self.patterns
+        if not patterns:
+            return
+        state = 0
+        for i, c in enumerate(s):
+            while state and c not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(c, 0)
+
+            match = state if output[state] >= 0 else dictionary[state]
+            while match > 0:
+                k = output[match]
+                yield i - len(patterns[k]) + 1, k
+                match = dictionary[match]
+
+    def occurrences(self, s: str) -> Dict[str, array]:
+        """All starting positions of every pattern in s, in ascending order"""
+        positions = [array("i") for _ in self.patterns]
+        for i, k in self.matches(s):
+            positions[k].append(i)
+        return OrderedDict(zip(self.patterns, positions))
+
+    def present(self, s: str) -> Set[str]:
+        """Patterns that occur in s"""
+        return {self.patterns[k] for _, k in self.matches(s)}
+
+
+def patterns(ts: List[str], rs: Dict[str, List[str]]) -> List[str]:
+    """
+    Strings the solver looks up in s: every replacement, every maximal run of lowercase
+    letters in a clause and every single lowercase letter in one.
+    """
+    result = [v for values in rs.values() for v in values]
+    for t in ts:
+        run = []
+        for l in t + "X":
+            if l.islower():
+                run.append(l)
+                result.append(l)
+            elif run:
+                result.append("".join(run))
+                run = []
+    return list(OrderedDict.fromkeys(result))
+
+
+def occurrences(s: str, ts: List[str], rs: Dict[str, List[str]]) -> Dict[str, array]:
+    """Occurrence lists of all patterns of an instance, found in one pass over s"""
+    automaton = AhoCorasick(patterns(ts, rs))
+    result = automaton.occurrences(s)
+    log.info("Found {} occurrences of {} patterns ({} states) in one pass over s.".format(
+        sum(map(len, result.values())), len(result), len(automaton)))
+    return result
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import argparse
+import cache
+import check
+import datetime
+import glob
+import io
+import json
+import logging
+import multiprocessing
+import os
+import parser
+import queue
+import sys
+
+from cache import ResultCache
+from index import SubstringIndex
+from typing import Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Instances given as SWE text of at most this many bytes are solved by the scheduler itself,
+# as handing them to a worker would take about as long as solving them
+TINY = 2048
+
+# (name, result, replacements, error, time taken) of a solved instance
+Outcome = Tuple[str, Optional[bool], Optional[Dict[str, str]], Optional[str], datetime.timedelta]
+
+
+def solve_instance(name: str, text: Optional[str], options: check.Options, results: ResultCache=None) -> Outcome:
+    """
+    Parse and decide a single instance in this process. The instance is the SWE text given, or
+    the file called name if there is none. Errors are reported instead of raised. Results are
+    looked up in and added to results, if given.
+    """
+    start = datetime.datetime.now()
+    try:
+        if text is None:
+            s, ts, rs, occurrences = parser.parse_file(name)
+        else:
+            s, ts, rs, occurrences = parser.parse_binary(io.BytesIO(text.encode()))
+        index = SubstringIndex(s)
+        index.seed(occurrences)
+        result, replacements = check.solve(s, ts, rs, index, options, processes=0, results=results)
+    except Exception as e:
+        log.exception("Solving {} failed".format(name))
+        return name, None, None, repr(e), datetime.datetime.now() - start
+    return name, result, replacements, None, datetime.datetime.now() - start
+
+
+def find_instances(sources: List[str]) -> Iterator[Tuple[str, Optional[str], int]]:
+    """
+    (name, text, size) of the .SWE files given, or found in the directories given, largest
+    first, so long ones do not end up starting last. Files are read by whoever solves them.
+    """
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(sorted(glob.glob(os.path.join(source, "*.SWE"))))
+        else:
+            paths.append(source)
+    for path in sorted(paths, key=os.path.getsize, reverse=True):
+        yield path, None, os.path.getsize(path)
+
+
+def read_jsonl(f) -> Iterator[Tuple[str, Optional[str], int]]:
+    """
+    (name, text, size) of the instances in a JSONL stream, one object per line with the SWE
+    text under "swe" and optionally a "name" (the line number by default), as they come in
+    """
+    for n, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        instance = json.loads(line)
+        yield str(instance.get("name", n)), instance["swe"], len(instance["swe"])
+
+
+def run(instances: Iterator[Tuple[str, Optional[str], int]], options: check.Options, processes: int=None,
+        tiny: int=TINY, report=None, results: ResultCache=None):
+    """
+    Solve all instances on a single pool of worker processes, each instance as a whole on
+    one worker (see check.A with processes=0). Tiny instances are solved right here in the
+    meantime. report is called with the Outcome of every instance as soon as it is known,
+    report_file by default. Instances are read from the iterator only while at most twice as many are in flight as
+    there are workers, so it may be an endless stream.
+    """
+    report = report or report_file
+    outcomes = queue.Queue()
+    pool = multiprocessing.Pool(processes)
+    processes = len(pool._pool)
+    log.info("Solving instances on {} worker processes.".format(processes))
+
+    def submit(name, text):
+        pool.apply_async(solve_instance, (name, text, options, results), callback=outcomes.put,
+                         error_callback=lambda e: outcomes.put((name, None, None, repr(e), datetime.timedelta())))
+
+    running = 0
+    try:
+        for name, text, size in instances:
+            while running and (running >= 2 * processes or not outcomes.empty()):
+                report(*outcomes.get())
+                running -= 1
+
+            if size <= tiny:
+                report(*solve_instance(name, text, options, results))
+            else:
+                submit(name, text)
+                running += 1
+
+        while running:
+            report(*outcomes.get())
+            running -= 1
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def report_file(name, result, replacements, error, elapsed):
+    """Write the .SOL of a solved .SWE file and print its status"""
+    if error is not None:
+        status = "ERROR {}".format(error)
+    elif result:
+        check.write_solution(name, replacements)
+        status = "YES"
+    else:
+        status = "UNKNOWN" if result is None else "NO"
+    print("{}: {} ({})".format(name, status, elapsed))
+    sys.stdout.flush()
+
+
+def outcome_json(name, result, replacements, error, elapsed) -> Dict:
+    """The outcome of an instance as a JSON object, solution included"""
+    outcome = {"name": name, "result": "ERROR" if error is not None else "YES" if result else
+               "UNKNOWN" if result is None else "NO",
+               "seconds": elapsed.total_seconds()}
+    if error is not None:
+        outcome["error"] = error
+    if result:
+        outcome["solution"] = replacements
+    return outcome
+
+
+def report_jsonl(*outcome):
+    """Print the outcome of an instance read from JSONL as a JSON line"""
+    print(json.dumps(outcome_json(*outcome)))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(message)s')
+
+    arg_parser = argparse.ArgumentParser(description="Decide many SWE instances on one pool of worker processes. "
+                                                     "Prints the status of each instance as soon as it is known.")
+    arg_parser.add_argument("sources", nargs="*", help=".SWE files, or directories with .SWE files")
+    arg_parser.add_argument("--jsonl", metavar="FILE",
+                            help='read instances from FILE (- for stdin), one JSON object per line with the SWE text '
+                                 'under "swe" and optionally a "name", and print outcomes as JSON lines')
+    arg_parser.add_argument("--processes", type=int, help="number of worker processes, all cores if not given")
+    arg_parser.add_argument("--tiny", type=int, default=TINY, metavar="BYTES",
+                            help="solve instances up to this size in the scheduling process itself")
+    arg_parser.add_argument("--verbose", action="store_true", help="log the progress of every instance")
+    check.add_search_arguments(arg_parser)
+    cache.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    options = check.get_options(arg_parser, args)
+    if bool(args.sources) == bool(args.jsonl):
+        arg_parser.error("give either .SWE files and directories, or --jsonl")
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if args.jsonl:
+        with (sys.stdin if args.jsonl == "-" else open(args.jsonl)) as f:
+            run(read_jsonl(f), options, args.processes, args.tiny, report_jsonl, cache.from_arguments(args))
+    else:
+        run(find_instances(args.sources), options, args.processes, args.tiny, report_file, cache.from_arguments(args))
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import haystack
+import json
+import logging
+import os
+import string
+
+from collections import OrderedDict, namedtuple
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Entries kept by default, see ResultCache
+SIZE = 10000
+
+# Bump when the way instances are put into canonical form changes, or old entries may be wrong
+# (version 2 stored local search giving up as no solution), so old entries are not hit
+VERSION = 3
+
+# Digest of the canonical form of an instance, and its variables in canonical order
+Key = namedtuple("Key", ["digest", "order"])
+
+
+def _rank(signatures: Dict[str, str]) -> Dict[str, int]:
+    """Number the distinct signatures in sorted order, so equal ones get equal numbers"""
+    ranks = {signature: n for n, signature in enumerate(sorted(set(signatures.values())))}
+    return {var: ranks[signature] for var, signature in signatures.items()}
+
+
+def canonical_order(ts: List[str], rs: Dict[str, List[str]]) -> List[str]:
+    """
+    Variables ordered by their role in the instance rather than by their names, so instances
+    that only differ in naming get the same order (colour refinement, as in graph isomorphism
+    testing). Variables start out coloured by their domain, and are then recoloured by their
+    colour and the clauses they occur in, written with the colours of the other variables,
+    until the colouring stops getting finer. Variables still alike are ordered by name, which
+    makes some renamed instances miss the cache, but never hit a wrong entry.
+    """
+    occurs = {var: [t for t in ts if var in t] for var in rs}
+    colors = _rank({var: repr(sorted(values)) for var, values in rs.items()})
+    while True:
+        def shape(t, var):
+            return "".join("=" if l == var else "<{}>".format(colors[l]) if l.isupper() else l for l in t)
+
+        refined = _rank({var: repr((colors[var], sorted(shape(t, var) for t in occurs[var]))) for var in rs})
+        if len(set(refined.values())) == len(set(colors.values())):
+            break
+        colors = refined
+    return sorted(rs, key=lambda var: (colors[var], var))
+
+
+def substitute(t: str, replacements: Dict[str, str]) -> str:
+    return "".join(replacements.get(l, l) for l in t)
+
+
+class ResultCache:
+    """
+    Results of earlier instances on disk, one small JSON file per instance in directory, so
+    it can be shared by processes. Instances are looked up after simplification (see
+    parser.simplify_problem) in canonical form, with variables renamed (see canonical_order)
+    and clauses and domains sorted, so a hit does not depend on how the instance was written.
+
+    Holds roughly size entries, dropping the ones least recently hit. If verify is set, a
+    cached solution is checked against s before it is returned, at the cost of looking up
+    every clause once. Cached answers that there is no solution cannot be checked this way.
+    """
+
+    def __init__(self, directory: str, size: int=SIZE, verify: bool=False):
+        self.directory = directory
+        self.size = size
+        self.verify = verify
+        self._entries = None
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, s: str, ts: List[str], rs: Dict[str, List[str]]) -> Key:
+        order = canonical_order(ts, rs)
+        names = dict(zip(order, string.ascii_uppercase))
+        instance = [VERSION, sorted(set(substitute(t, names) for t in ts)), [sorted(set(rs[var])) for var in order]]
+        digest = hashlib.sha256(json.dumps(instance).encode())
+        digest.update(s.buf if isinstance(s, haystack.Haystack) else s.encode("ascii"))
+        return Key(digest.hexdigest(), order)
+
+    def _path(self, key: Key) -> str:
+        return os.path.join(self.directory, key.digest + ".json")
+
+    def get(self, key: Key, index, ts: List[str]) -> Optional[Tuple[bool, Optional[Dict[str, str]]]]:
+        """(result, replacements) stored for key, or None if there are none (or they are wrong)"""
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        if not entry["result"]:
+            log.info("Found in cache: no solution.")
+            return False, None
+
+        # Sorted by variable, like the solutions of check.solve
+        replacements = OrderedDict(sorted(zip(key.order, entry["solution"])))
+        if self.verify and not all(substitute(t, replacements) in index for t in ts):
+            log.warning("Cached solution {} does not fit the instance, dropping it.".format(key.digest))
+            self._remove(path)
+            return None
+        log.info("Found in cache: solution.")
+        return True, replacements
+
+    def put(self, key: Key, result: bool, replacements: Optional[Dict[str, str]]):
+        """Store a definite result for key. Unknown ones (see check.A) must not be stored."""
+        if result is None:
+            raise ValueError("Only definite results can be cached")
+        entry = {"result": result}
+        if result:
+            entry["solution"] = [replacements[var] for var in key.order]
+
+        # Written aside and moved in place, so others never read half an entry
+        path = self._path(key)
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as f:
+            json.dump(entry, f)
+        os.replace(temporary, path)
+
+        if self._entries is None:
+            self._entries = len(self._list())
+        self._entries += 1
+        if self._entries > self.size:
+            self._evict()
+
+    def _list(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")]
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            # Evicted by another process in the meantime
+            pass
+
+    def _evict(self):
+        """Drop the least recently hit entries, down to nine tenths of size"""
+        entries = []
+        for entry in self._list():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                pass
+        entries.sort()
+        keep = self.size * 9 // 10
+        for _, path in entries[:max(0, len(entries) - keep)]:
+            self._remove(path)
+        log.info("Evicted {} entries from the cache.".format(max(0, len(entries) - keep)))
+        self._entries = min(len(entries), keep)
+
+
+def add_arguments(arg_parser: argparse.ArgumentParser):
+    """Command line options for a ResultCache, see from_arguments"""
+    arg_parser.add_argument("--cache", metavar="DIR", help="remember results in DIR, and reuse them for instances "
+                                                           "that only differ in order, duplicates or variable names")
+    arg_parser.add_argument("--cache-size", type=int, default=SIZE, metavar="N",
+                            help="number of results to keep, dropping the ones least recently used")
+    arg_parser.add_argument("--cache-verify", action="store_true", help="check cached solutions before using them")
+
+
+def from_arguments(args: argparse.Namespace) -> Optional[ResultCache]:
+    return ResultCache(args.cache, args.cache_size, args.cache_verify) if args.cache else None
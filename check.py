@@ -1,15 +1,35 @@
 #!/usr/bin/env python3
+import ahocorasick
+import argparse
+import cache
+import cnf
+import consistency
+import counting
 import ctypes
 import datetime
+import haystack
+import localsearch
 import logging
+import memo
 import multiprocessing
+import os
 import random
+import resource
+import scoring
+import shared
+import shiftand
 import string
 import parser
+import queue
+import signal
 import sys
+import threading
 
-from collections import OrderedDict
-from typing import Tuple, Set, List, Dict
+from cache import ResultCache
+from collections import Counter, OrderedDict, namedtuple
+from index import SubstringIndex
+from multiprocessing import resource_tracker
+from typing import Tuple, Set, List, Dict, Optional
 
 # Convert to set for O(1) lookup
 LOWERCASE = set(string.ascii_lowercase)
@@ -18,82 +38,498 @@ ASCII_LETTERS = LOWERCASE | UPPERCASE
 
 log = logging.getLogger(__name__)
 
+# Statistic holding the largest resident memory of any process that searched, see merge_stats
+PEAK_MEMORY = "peak memory of a worker (kB)"
 
-LEN_TS = None
-NUM_SOLS = None
+# propagation: 'position' branches on every place a clause can start, 'bitset' tracks
+# all of them at once in a single integer
+# variable_order: 'static' branches on the first unassigned variable of the current clause,
+# 'mrv' on the variable with the fewest feasible values left (see choose_variable)
+# clause_order: 'static' works on clauses in parse order, 'fewest-placements' and 'most-bound'
+# pick the next clause at runtime (see schedule_clause)
+# backjumping: on failure, jump back to the deepest decision responsible and remember the
+# responsible partial assignment as a nogood (see _branch)
+# memo_size: megabytes per worker for remembering clause feasibility (see clause_supports), and
+# as much again for each of the bitmaps of patterns and of variables (see _init_search)
+# engine: 'recursive' runs _A or _A_bitset, 'iterative' runs _A_iterative, which only supports
+# the static variable and clause order without backjumping, 'sat' encodes the instance as CNF
+# and runs a CDCL solver (see cnf.py), 'local' runs stochastic local search (see localsearch.py),
+# which only ever finds solutions and gives up after max_flips steps (0 for never), answering
+# None: unknown whether there is a solution
+# work_stealing: let workers hand out untried branches to idle workers (see donate), only
+# done by the recursive engine
+# value_order: 'static' tries replacements as parsed (longest first), 'shortest' shortest first
+# and 'random' in an order shuffled with seed
+Options = namedtuple("Options", ["propagation", "variable_order", "clause_order", "backjumping", "memo_size", "engine",
+                                 "work_stealing", "value_order", "seed", "max_flips"])
+DEFAULT_OPTIONS = Options(propagation="position", variable_order="static", clause_order="static", backjumping=False,
+                          memo_size=64, engine="recursive", work_stealing=True, value_order="static", seed=0,
+                          max_flips=0)
+
+# Values the fields of Options that are not numbers or flags can take, see check_options
+CHOICES = {
+    "propagation": ["position", "bitset"],
+    "variable_order": ["static", "mrv"],
+    "clause_order": ["static", "fewest-placements", "most-bound"],
+    "engine": ["recursive", "iterative", "sat", "local"],
+    "value_order": ["static", "shortest", "random"],
+}
+
+# Configurations raced by portfolio, after the one given on the command line
+PORTFOLIO = [
+    DEFAULT_OPTIONS._replace(propagation="bitset"),
+    DEFAULT_OPTIONS._replace(variable_order="mrv", backjumping=True),
+    DEFAULT_OPTIONS._replace(propagation="bitset", variable_order="mrv", value_order="random", seed=1),
+    DEFAULT_OPTIONS._replace(engine="sat"),
+    DEFAULT_OPTIONS._replace(engine="local"),
+]
+
+# Intermediate answers printed to stdout (see report_progress): num_sols is shared by every
+# search printing them, and holds the number of clauses satisfied by the best one so far. fixed
+# assigns the variables the search does not decide, such as those of other components (see
+# solve_components), and is printed along. satisfied is the number of clauses outside the
+# search that are known to be satisfied by fixed.
+Progress = namedtuple("Progress", ["num_sols", "fixed", "satisfied"])
+
+SCORER = None
+PROGRESS = None
+INSTANCE = None
+INDEX = None
+OPTIONS = DEFAULT_OPTIONS
+UNIONS = None
+LENGTHS = None
+DOMAINS = None
+STATS = Counter()
+NOGOODS = {}
+MEMO = memo.TranspositionTable(0, STATS)
 LOCAL_NUM_SOLS = 0
 
+# Work stealing: number of idle workers, number of starting points not yet exhausted, queue
+# of donated starting points, and the choice points of the current search (see donate)
+HUNGRY = None
+PENDING = None
+DONATIONS = None
+FRAMES = []
+EVERYTHING = set()
+
 
 class ResultFound(Exception):
     def __init__(self, replacements):
         self.replacements = replacements
 
 
-def findall(string, sub, offset=0):
-    i = string.find(sub, offset)
-    while i >= 0:
-        yield i
-        i = string.find(sub, i+1)
-
-
-def get_num_solutions(s, ts, expansions):
-    solutions = LEN_TS - len(ts)
-    for t in ts:
-        ss = "".join(expansions.get(l, l) for l in t)
-        if ss.islower() and ss in s:
-            solutions += 1
-    return solutions
+def get_num_solutions(expansions):
+    # Clauses satisfied already are fully assigned, so SCORER counts them along with the rest
+    SCORER.update(expansions)
+    return SCORER.score
 
 
-def print_map(s, ts, expansions):
-    global NUM_SOLS
+def print_map(expansions):
     global LOCAL_NUM_SOLS
 
-    if random.random() < 0.9999:
+    if PROGRESS is None or random.random() < 0.9999:
         return
 
-    n_solutions_found = get_num_solutions(s, ts, expansions)
+    n_solutions_found = PROGRESS.satisfied + get_num_solutions(expansions)
 
     if n_solutions_found <= LOCAL_NUM_SOLS:
         return
 
-    with NUM_SOLS.get_lock():
-        if n_solutions_found <= NUM_SOLS.value:
-            LOCAL_NUM_SOLS = NUM_SOLS.value
-            return
+    LOCAL_NUM_SOLS = report_progress(PROGRESS, expansions, n_solutions_found)
+
+
+def new_progress() -> Progress:
+    """Progress of a search over a whole instance, before any answer is printed"""
+    # Held back like in A, as the shared value is backed by a temporary file for a moment
+    mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    try:
+        return Progress(multiprocessing.Value(ctypes.c_int), {}, 0)
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+
+
+def report_progress(progress: Progress, expansions, satisfied: int) -> int:
+    """
+    Print expansions, completed by progress.fixed, as an intermediate answer if the satisfied
+    clauses beat the best answer printed so far. Returns the clauses satisfied by the best one.
+    """
+    # A portfolio member cancelled halfway (see _cancel) would leave half an answer on stdout,
+    # or the lock taken
+    mask = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    try:
+        with progress.num_sols.get_lock():
+            if satisfied > progress.num_sols.value:
+                print_assignment(dict(progress.fixed, **expansions), separator=bool(progress.num_sols.value))
+                progress.num_sols.value = satisfied
+            return progress.num_sols.value
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+
+
+def print_assignment(expansions, separator):
+    """Print the assigned variables to stdout as an intermediate answer, after a separator line if asked to"""
+    lines = ["---"] if separator else []
+    lines.extend("{}:{}".format(key, expansion) for key, expansion in sorted(expansions.items()) if key.isupper())
+
+    # In a single write, so answers of processes sharing stdout do not interleave
+    sys.stdout.write("".join(line + "\n" for line in lines))
+    sys.stdout.flush()
+
+
+def clause_supports(index: SubstringIndex, t: str, expansions, domains, unions):
+    """
+    consistency.clause_supports of clause t under the current assignment. These only depend on
+    the assignment of the variables in t, so they are remembered in MEMO.
+    """
+    key = ("supports", t, tuple(expansions.get(l) for l in t if l.isupper()))
+    supported = MEMO.get(key)
+    if supported is memo.MISSING:
+        supported = consistency.clause_supports(index, [expansions.get(l, l) for l in t], domains, unions)
+        MEMO.put(key, supported)
+    return supported
+
+
+def placements(index: SubstringIndex, t: str, expansions, unions) -> int:
+    """Positions where clause t can end under the current assignment, remembered in MEMO"""
+    key = ("placements", t, tuple(expansions.get(l) for l in t if l.isupper()))
+    frontier = MEMO.get(key)
+    if frontier is memo.MISSING:
+        frontier = consistency.walk(index, [expansions.get(l, l) for l in t], unions)
+        MEMO.put(key, frontier)
+    return frontier
+
+
+def start_positions(index: SubstringIndex, t: str, expansions) -> List[int]:
+    """
+    Positions where clause t can start under the current assignment, as far as it is known from
+    its first letter on: letters, replacements of assigned variables and unassigned variables
+    whose replacements all have the same length (as gaps). Those of the first letter alone
+    are simply looked up, longer patterns are matched at once (see shiftand) and remembered
+    in MEMO.
+    """
+    pieces = []
+    for l in t:
+        if l in expansions:
+            pieces.append(expansions[l])
+        elif len(LENGTHS[l]) == 1:
+            length, = LENGTHS[l]
+            pieces.append(length)
+        else:
+            break
+    if len(pieces) == 1:
+        return index.find_all(pieces[0])
+
+    key = ("starts", t, tuple(expansions.get(l) for l in t if l.isupper()))
+    positions = MEMO.get(key)
+    if positions is memo.MISSING:
+        positions = shiftand.ShiftAnd(pieces).find_all(index)
+        MEMO.put(key, positions)
+    return positions
+
+
+def feasible_domains(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], expansions, domains, unions):
+    """
+    Values of every unassigned variable that all remaining clauses still support under the
+    current assignment, or None if some variable has none left. Supports are computed against
+    the domains at the start of the search, so they can be remembered.
+    """
+    feasible = {}
+    for t in ts:
+        if all(l in expansions for l in t):
+            continue
+
+        supported = clause_supports(index, t, expansions, domains, unions)
+        if supported is None:
+            return None
+
+        for var, values in supported.items():
+            feasible[var] = [v for v in feasible.get(var, rs[var]) if v in values]
+            if not feasible[var]:
+                return None
+
+    return feasible
+
+
+def most_constrained(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], expansions, domains, unions):
+    """
+    The variable with the fewest feasible values, preferring variables occurring in more
+    remaining clauses on ties. Returns it with the domains to continue with, or (None, None)
+    if some variable has no feasible value left.
+    """
+    feasible = feasible_domains(index, ts, rs, expansions, domains, unions)
+    if feasible is None:
+        return None, None
+
+    degree = Counter(l for t in ts for l in set(t) if l in feasible)
+    var = min(feasible, key=lambda x: (len(feasible[x]), -degree[x], x))
+    return var, OrderedDict(rs, **feasible)
+
+
+def choose_variable(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], expansions, var):
+    """
+    Pick the variable to branch on. The static order takes var, the first unassigned variable
+    of the current clause, 'mrv' the most constrained one. Returns the variable and the domains
+    to continue with, or (None, None) if the current branch is infeasible.
+    """
+    if OPTIONS.variable_order == "mrv":
+        return most_constrained(index, ts, rs, expansions, DOMAINS, UNIONS)
+    return var, rs
+
+
+def schedule_clause(index: SubstringIndex, ts: List[str], expansions) -> Tuple[int, bool]:
+    """
+    Index in ts of the clause to work on next. 'fewest-placements' picks the clause with the
+    fewest places left in s, 'most-bound' the clause with the largest share of its variables
+    assigned. The second element is False (and the index that of the culprit) if it is already
+    clear some clause cannot be placed.
+    """
+    if OPTIONS.clause_order == "fewest-placements":
+        counts = []
+        for j, t in enumerate(ts):
+            frontier = placements(index, t, expansions, UNIONS)
+            if not frontier:
+                return j, False
+            counts.append(bin(frontier).count("1"))
+        return min(range(len(ts)), key=counts.__getitem__), True
+
+    if OPTIONS.clause_order == "most-bound":
+        def unbound(t):
+            variables = set(filter(str.isupper, t))
+            free = [v for v in variables if v not in expansions]
+            return len(free) / len(variables) if variables else 0, len(free)
+        return min(range(len(ts)), key=lambda j: unbound(ts[j])), True
+
+    return 0, True
+
+
+def conflict(clauses: List[str], expansions, *decisions):
+    """
+    Conflict set explaining a failure: the assigned variables of the clauses involved, plus
+    any other decisions (such as '@' + clause for the position picked for a clause). Without
+    backjumping this is just False.
+    """
+    if not OPTIONS.backjumping:
+        return False
+    return {l for t in clauses for l in t if l.isupper() and l in expansions}.union(decisions)
+
+
+def violated_nogood(var, replacement, expansions):
+    """Variables of a learned nogood that assigning replacement to var would complete, or None"""
+    for nogood in NOGOODS.get((var, replacement), ()):
+        if all(expansions.get(x) == value for x, value in nogood if x != var):
+            return {x for x, _ in nogood}
+    return None
+
+
+def learn(var, conflicts, expansions):
+    """
+    All replacements of var failed because of conflicts. Store the responsible partial assignment
+    as a nogood, so it is never explored again, and pass the conflict on to the parent.
+    """
+    conflicts = conflicts - {var}
+    if not any(x.startswith("@") for x in conflicts):
+        nogood = frozenset((x, expansions[x]) for x in conflicts)
+        for key in nogood:
+            NOGOODS.setdefault(key, []).append(nogood)
+        STATS["nogoods learned"] += 1
+    return conflicts
+
+
+def _branch(search, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], expansions, positions, var):
+    """
+    Branch off with all possible replacements of var (or of a more constrained variable, see
+    choose_variable), continuing each branch with search. With backjumping, branches are cut
+    short as soon as a child reports a conflict that does not involve the chosen variable.
+    """
+    var, _rs = choose_variable(index, ts, rs, expansions, var)
+    if var is None:
+        print_map(expansions)
+        return conflict(ts, expansions)
+
+    conflicts = set()
+    if OPTIONS.backjumping and len(_rs[var]) < len(DOMAINS[var]):
+        # Replacements ruled out along the way, by the clauses var occurs in
+        conflicts |= conflict([t for t in ts if var in t], expansions)
+
+    frame = Frame(var, _rs[var], ts, _rs, expansions, positions)
+    FRAMES.append(frame)
+    try:
+        while frame.next < len(frame.values):
+            replacement = frame.values[frame.next]
+            frame.next += 1
+            if HUNGRY is not None and HUNGRY.value > 0:
+                donate()
+
+            if OPTIONS.backjumping:
+                nogood = violated_nogood(var, replacement, expansions)
+                if nogood is not None:
+                    STATS["nogood cutoffs"] += 1
+                    conflicts |= nogood
+                    continue
+
+            _expansions = expansions.copy()
+            _expansions[var] = replacement
+            _conflict = search(index, ts, _rs, _expansions, positions)
+
+            if OPTIONS.backjumping:
+                if var not in _conflict:
+                    # Nothing we try for var can fix this: jump back to the responsible decision
+                    STATS["backjumps"] += 1
+                    return _conflict
+                conflicts |= _conflict
+    finally:
+        FRAMES.pop()
+
+    print_map(expansions)
+    if not OPTIONS.backjumping:
+        return False
+    if frame.donated:
+        # Part of this subtree is searched elsewhere, so we cannot tell what caused it to fail
+        return EVERYTHING
+    return learn(var, conflicts, expansions)
+
+
+class Frame:
+    """Choice point of _branch: replacements values[next:] of var are still to be tried"""
+    __slots__ = ["var", "values", "next", "ts", "rs", "expansions", "positions", "donated"]
+
+    def __init__(self, var, values, ts, rs, expansions, positions):
+        self.var = var
+        self.values = values
+        self.next = 0
+        self.ts = ts
+        self.rs = rs
+        self.expansions = expansions
+        self.positions = positions
+        self.donated = False
+
+
+def donate():
+    """
+    Some worker is idle: hand the untried replacements of the outermost choice point that
+    has any to it, as new starting points. That choice point and the ones around it then
+    no longer see their whole subtree, so they must not learn nogoods or backjump.
+    """
+    for depth, frame in enumerate(FRAMES):
+        if frame.next < len(frame.values):
+            break
+    else:
+        return
+
+    tasks = [INSTANCE.describe(frame.ts, frame.rs, dict(frame.expansions, **{frame.var: value}), frame.positions)
+             for value in frame.values[frame.next:]]
+    frame.values = frame.values[:frame.next]
+    for outer in FRAMES[:depth+1]:
+        outer.donated = True
+
+    # Count them before they are sent, so the search cannot look finished in the meantime
+    with PENDING.get_lock():
+        PENDING.value += len(tasks)
+    for task in tasks:
+        DONATIONS.put(task)
+    HUNGRY.value = max(0, HUNGRY.value - len(tasks))
+    STATS["donated"] += len(tasks)
 
-        if NUM_SOLS.value:
-            print("---".format(n_solutions_found, LEN_TS))
 
-        for key, expansion in sorted(expansions.items()):
-            if key.isupper():
-                print(key, end="")
-                print(":", end="")
-                print(expansion)
+def _init_search(index: SubstringIndex, clauses: List[str], domains: Dict[str, List[str]], progress, options,
+                 hungry, pending, donations):
+    """Set up the state of a search over the given instance, replacing whatever was left by an earlier one"""
+    global SCORER
+    global PROGRESS
+    global LOCAL_NUM_SOLS
+    global INDEX
+    global OPTIONS
+    global MEMO
+    global NOGOODS
+    global EVERYTHING
+    global DOMAINS
+    global UNIONS
+    global LENGTHS
+    global HUNGRY
+    global PENDING
+    global DONATIONS
+    INDEX = index
+    SCORER = scoring.Scorer(index, clauses)
+    PROGRESS = progress
+    LOCAL_NUM_SOLS = 0
+    OPTIONS = options
+    MEMO = memo.TranspositionTable(options.memo_size * 2**20, STATS)
+    # Bitmaps take len(s) / 8 bytes each, so they are bounded like MEMO rather than made for
+    # every variable and pattern up front, which would take memory growing with s per worker
+    index.limit_bitmaps(options.memo_size * 2**20)
+    NOGOODS = {}
+    # Conflict set blaming every decision there can be, see _branch
+    EVERYTHING = set(domains) | {"@" + t for t in clauses}
+    # Domains at the root of the search, shared by all starting points
+    DOMAINS = domains
+    UNIONS = consistency.LengthBitmaps(index, domains, options.memo_size * 2**20)
+    LENGTHS = {x: {len(v) for v in values} for x, values in domains.items()}
+    HUNGRY = hungry
+    PENDING = pending
+    DONATIONS = donations
+
 
-        sys.stdout.flush()
+def _end_search():
+    """
+    Forget what an in-process search learned about its instance. The search before the next
+    one in this process (see A) would otherwise look up feasibility remembered for another s.
+    """
+    global MEMO
+    global NOGOODS
+    MEMO = memo.TranspositionTable(0, STATS)
+    NOGOODS = {}
 
-        NUM_SOLS.value = n_solutions_found
 
-    LOCAL_NUM_SOLS = n_solutions_found
+def _init_process(progress, instance_name, options, hungry, pending, donations):
+    global INSTANCE
+    # Pool.terminate relies on the default, which a portfolio member changes for itself. A
+    # SIGTERM received before now was held back (see A).
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+    # The instance lives in shared memory, see shared.SharedInstance
+    INSTANCE = shared.SharedInstance.attach(instance_name)
+    _init_search(INSTANCE.index, INSTANCE.clauses, INSTANCE.domains, progress, options, hungry, pending, donations)
 
 
-def _init_process(num_sols):
-    global NUM_SOLS
-    NUM_SOLS = num_sols
+def __A(description):
+    return _search(*INSTANCE.task(description))
 
 
-def __A(args):
-    global LEN_TS
-    s, ts, rs, expansions, positions = args
-    LEN_TS = len(ts)
-    return _A(s, ts, rs, expansions, positions)
+def _search(ts, rs, expansions, positions):
+    FRAMES.clear()
+    STATS.clear()
+
+    try:
+        if OPTIONS.engine == "iterative":
+            _conflict = _A_iterative(INDEX, ts, rs, expansions, positions)
+        elif OPTIONS.propagation == "bitset":
+            _conflict = _A_bitset(INDEX, ts, rs, expansions, positions)
+        else:
+            _conflict = _A(INDEX, ts, rs, expansions, positions)
+    except ResultFound as e:
+        STATS[PEAK_MEMORY] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        e.stats = dict(STATS)
+        raise
 
+    STATS[PEAK_MEMORY] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(STATS), _conflict
 
-def _A(s: str, ts: List[str], rs: Dict[str, Set[str]], expansions, positions) -> bool:
+
+def _A(index: SubstringIndex, ts: List[str], rs: Dict[str, Set[str]], expansions, positions):
     # Positions indicate where we are when searching a
+    STATS["nodes"] += 1
 
     while ts:
+        if positions[0] == -1:
+            # Not committed to a place for the current clause yet, so we may switch clauses
+            j, placeable = schedule_clause(index, ts, expansions)
+            if not placeable:
+                STATS["scheduling cutoffs"] += 1
+                print_map(expansions)
+                return conflict([ts[j]], expansions)
+            ts = [ts[j]] + ts[:j] + ts[j+1:]
+            positions = [positions[j]] + positions[:j] + positions[j+1:]
+
         position = positions[0]
         clause = ts[0]
 
@@ -102,111 +538,691 @@ def _A(s: str, ts: List[str], rs: Dict[str, Set[str]], expansions, positions) ->
 
             # CASE 1
             if letter_or_expansion.isupper():
-                # We found a capital letter, meaning we should choose a replacement for it: so
-                # we branch off with all possible replacements
-                for replacement in rs[letter_or_expansion]:
-                    _expansions = expansions.copy()
-                    _expansions[letter_or_expansion] = replacement
-                    _A(s, ts, rs, _expansions, positions)
-                print_map(s, ts, expansions)
-                return False
+                # We found a capital letter, meaning we should choose a replacement for it (or
+                # for a more constrained variable): so we branch off with all possible replacements
+                return _branch(_A, index, ts, rs, expansions, positions, letter_or_expansion)
 
             # We see a small letter
             if position >= 0:
                 # ..if its position is known, just check it and move on to next letter in clause
                 # Please not that 'letter' can also be more than one character if it a replacement
-                if not s[position:].startswith(letter_or_expansion):
+                if not index.startswith(letter_or_expansion, position):
                     # Expansion does not fit here in this string. Invalid branch!
-                    print_map(s, ts, expansions)
-                    return False
+                    print_map(expansions)
+                    return conflict([clause], expansions, "@" + clause)
 
                 position += len(letter_or_expansion)
             else:
                 # .. its position is not known. Find all suitable starting places.
-                for i in findall(s, letter_or_expansion):
+                conflicts = conflict([clause], expansions)
+                for i in start_positions(index, clause, expansions):
                     _positions = positions.copy()
                     _positions[0] = i
-                    _A(s, ts, rs, expansions, _positions)
-                print_map(s, ts, expansions)
-                return False
+                    _conflict = _A(index, ts, rs, expansions, _positions)
+                    if OPTIONS.backjumping:
+                        if "@" + clause not in _conflict:
+                            STATS["backjumps"] += 1
+                            return _conflict
+                        conflicts |= _conflict - {"@" + clause}
+                print_map(expansions)
+                return conflicts
 
         # We have finished a clause, lets move on to the next
         ts = ts[1:]
         positions = positions[1:]
 
     # We've passed all the clauses without encountering an error. Result found!
-    print_map(s, ts, expansions)
+    print_map(expansions)
     raise ResultFound(OrderedDict(sorted((k, v) for k, v in expansions.items() if k.isupper())))
 
 
-def A(s: str, ts: List[str], rs: Dict[str, Set[str]]) -> Tuple[bool, Dict]:
+def _A_bitset(index: SubstringIndex, ts: List[str], rs: Dict[str, Set[str]], expansions, frontiers):
+    # Same search as _A, but positions are never branched on. Instead, each clause keeps
+    # the number of letters matched so far and a frontier: a bitset with bit i set iff the
+    # matched part of the clause can end at position i of s. None means not started yet.
+    STATS["nodes"] += 1
+
+    while ts:
+        if frontiers[0] is None:
+            j, placeable = schedule_clause(index, ts, expansions)
+            if not placeable:
+                STATS["scheduling cutoffs"] += 1
+                print_map(expansions)
+                return conflict([ts[j]], expansions)
+            ts = [ts[j]] + ts[:j] + ts[j+1:]
+            frontiers = [frontiers[j]] + frontiers[:j] + frontiers[j+1:]
+
+        done, frontier = frontiers[0] or (0, index.everywhere)
+        clause = ts[0]
+
+        for n in range(done, len(clause)):
+            letter_or_expansion = expansions.get(clause[n], clause[n])
+
+            if letter_or_expansion.isupper():
+                # Branch on all possible replacements, remembering how far we got in this clause
+                _frontiers = [(n, frontier)] + frontiers[1:]
+                return _branch(_A_bitset, index, ts, rs, expansions, _frontiers, letter_or_expansion)
+
+            # Keep the positions where the expansion fits and move past it
+            frontier = (frontier & index.bitmap(letter_or_expansion)) << len(letter_or_expansion)
+            if not frontier:
+                print_map(expansions)
+                return conflict([clause], expansions)
+
+        ts = ts[1:]
+        frontiers = frontiers[1:]
+
+    print_map(expansions)
+    raise ResultFound(OrderedDict(sorted((k, v) for k, v in expansions.items() if k.isupper())))
+
+
+def _A_iterative(index: SubstringIndex, ts: List[str], rs: Dict[str, Set[str]], expansions, positions) -> bool:
+    # Same search as _A (or _A_bitset), without recursion and without copying anything per
+    # branch. There is a single assignment, extended in place, and a trail of the variables
+    # assigned so far so choices can be undone. Every choice point on the stack remembers the
+    # clause and letter it was made at, the clause's position (or frontier) at that time, the
+    # length of the trail and the candidates: replacements of a variable, or places in s.
+    bitset = OPTIONS.propagation == "bitset"
+    fresh = index.everywhere if bitset else -1
+    assignment = expansions.copy()
+    trail = []
+    stack = []
+
+    c = n = 0
+    state = fresh
+
+    while True:
+        if c == len(ts):
+            # We've passed all the clauses without encountering an error. Result found!
+            print_map(assignment)
+            raise ResultFound(OrderedDict(sorted((k, v) for k, v in assignment.items() if k.isupper())))
+
+        clause = ts[c]
+        if n == len(clause):
+            # We have finished a clause, lets move on to the next
+            c += 1
+            n = 0
+            state = fresh
+            continue
+
+        letter_or_expansion = assignment.get(clause[n], clause[n])
+
+        if letter_or_expansion.isupper():
+            stack.append([letter_or_expansion, rs[letter_or_expansion], 0, c, n, state, len(trail)])
+        elif bitset:
+            state = (state & index.bitmap(letter_or_expansion)) << len(letter_or_expansion)
+            if state:
+                n += 1
+                continue
+            print_map(assignment)
+        elif state >= 0:
+            if index.startswith(letter_or_expansion, state):
+                state += len(letter_or_expansion)
+                n += 1
+                continue
+            print_map(assignment)
+        else:
+            stack.append([None, start_positions(index, clause, assignment), 0, c, n, state, len(trail)])
+
+        # Either we failed or we just added a choice point: continue with the next candidate
+        # of the deepest choice point that has any left
+        while stack:
+            choice = stack[-1]
+            var, candidates, i, c, n, state, depth = choice
+
+            while len(trail) > depth:
+                del assignment[trail.pop()]
+
+            if i < len(candidates):
+                choice[2] = i + 1
+                STATS["nodes"] += 1
+                if var is None:
+                    state = candidates[i]
+                else:
+                    assignment[var] = candidates[i]
+                    trail.append(var)
+                break
+
+            stack.pop()
+        else:
+            return False
+
+
+def verify(index: SubstringIndex, ts: List[str], replacements: Dict[str, str]):
+    """Check all clauses are satisfied by replacements. Raises ValueError if not."""
+    for old_clause in ts:
+        new_clause = old_clause
+        for var, replacement in replacements.items():
+            new_clause = new_clause.replace(var, replacement)
+        if new_clause in index:
+            log.info("  substring found: {} -> {}".format(old_clause, new_clause))
+        else:
+            log.error("  substring found: {} -> {}".format(old_clause, new_clause))
+            raise ValueError("substring not found, but A determined it valid. Bug!")
+
+
+def merge_stats(stats: Counter, _stats: Dict):
+    """Add the statistics of the search from one starting point to stats, see _search"""
+    peak = max(stats[PEAK_MEMORY], _stats.get(PEAK_MEMORY, 0))
+    stats.update(_stats)
+    stats[PEAK_MEMORY] = peak
+
+
+def log_stats(stats):
+    log.info("Search statistics:")
+    for key, value in sorted(stats.items()):
+        log.info("  {}: {}".format(key, value))
+
+
+def order_values(rs: Dict[str, List[str]], options: Options) -> Dict[str, List[str]]:
+    """Domains in the order their values should be tried, see Options.value_order"""
+    if options.value_order == "shortest":
+        return OrderedDict((x, sorted(values, key=lambda v: (len(v), v))) for x, values in rs.items())
+    if options.value_order == "random":
+        rng = random.Random(options.seed)
+        return OrderedDict((x, rng.sample(values, len(values))) for x, values in rs.items())
+    return rs
+
+
+def describe_options(options: Options) -> str:
+    """Options that differ from the defaults, for logging"""
+    changed = ["{}={}".format(k, v) for k, v in options._asdict().items() if v != getattr(DEFAULT_OPTIONS, k)]
+    return ", ".join(changed) or "defaults"
+
+
+def run_tasks(pool, arguments, hungry, pending, donations):
+    """
+    Search from all starting points in arguments on pool, yielding (stats, conflict) for every
+    starting point that leads to a dead end. While fewer starting points are left than there
+    are workers, busy workers donate parts of their search tree as new starting points (see
+    donate), which are run as well. Raises ResultFound when some starting point has a solution.
     """
-    Decision algorithm for the problem specified in the project assignment.
+    events = queue.Queue()
+
+    def submit(args):
+        pool.apply_async(__A, (args,), callback=lambda result: events.put((True, result)),
+                         error_callback=lambda error: events.put((False, error)))
+
+    def forward_donations():
+        for args in iter(donations.get, None):
+            events.put((None, args))
+
+    forwarder = threading.Thread(target=forward_donations, daemon=True)
+    forwarder.start()
+
+    pending.value = len(arguments)
+    running = len(arguments)
+    for args in arguments:
+        submit(args)
+
+    try:
+        # Donations may still be on their way when nothing is running, so only pending tells
+        # when the search is over
+        while True:
+            hungry.value = max(0, len(pool._pool) - running)
+            finished, payload = events.get()
+            if finished is None:
+                submit(payload)
+                running += 1
+                continue
+            if not finished:
+                raise payload
+
+            running -= 1
+            yield payload
+            with pending.get_lock():
+                pending.value -= 1
+                if not pending.value:
+                    break
+    finally:
+        donations.put(None)
+        forwarder.join()
+
+
+def A(s: str, ts: List[str], rs: Dict[str, Set[str]], index: SubstringIndex=None, options: Options=DEFAULT_OPTIONS,
+      processes: int=None, progress: Progress=None) -> Tuple[Optional[bool], Dict]:
+    """
+    Decision algorithm for the problem specified in the project assignment. Answers None instead
+    of True or False when it does not know, which only local search does when it gives up.
 
     @param s: string which must contain substrings
     @param ts: k strings t1,t2...tk \in (E U T)*
     @param rs: mapping from element in T -> [expansion]
+    @param index: substring index over s, built here if not given
+    @param options: search settings, see Options
+    @param processes: number of worker processes, all cores if not given. With 0 the search runs
+                      in this process, without printing intermediate answers (see batch.py).
+    @param progress: intermediate answers printed so far, none if not given (see Progress)
     """
     log.info("Checking {s} with {k} clauses and {x} variables.".format(s=s, k=len(ts), x=len(rs)))
 
     # If any of the RHS's is now empty, we're requesting something impossible
     if not all(rs.values()):
-        return False
+        return False, None
+
+    if index is None:
+        index = SubstringIndex(s)
+        index.seed(ahocorasick.occurrences(s, ts, rs))
+    rs = order_values(rs, options)
+    if not any(l.isupper() for t in ts for l in t):
+        # Nothing to choose, the clauses occur in s or they do not
+        return all(t in index for t in ts), OrderedDict((x, values[0]) for x, values in rs.items())
+
+    if options.engine == "sat":
+        replacements = cnf.solve(index, ts, rs)
+        if replacements is None:
+            return False, None
+        log.info("Solution found. Checking..")
+        verify(index, ts, replacements)
+        return True, replacements
+
+    if options.engine == "local":
+        if processes != 0 and progress is None:
+            progress = new_progress()
+
+        def improved(assignment, satisfied):
+            log.info("  Satisfied {} of {} clauses".format(satisfied, len(ts)))
+            if processes != 0:
+                report_progress(progress, assignment, progress.satisfied + satisfied)
+
+        replacements = localsearch.search(index, ts, rs, options.seed, options.max_flips, improved)
+        if replacements is None:
+            log.info("Local search gave up, which does not mean there is no solution.")
+            return None, None
+        log.info("Solution found. Checking..")
+        verify(index, ts, replacements)
+        return True, replacements
 
-    num_sols = multiprocessing.Value(ctypes.c_int)
-    pool = multiprocessing.Pool(initializer=_init_process, initargs=(num_sols,))
-    var = next(filter(str.isupper, "".join(ts)))
     expansions = {l: l for l in LOWERCASE}
-    arguments = [(s, ts.copy(), rs.copy(), dict(**expansions, **{var: x}), [-1]*len(ts)) for x in rs[var]]
+    var = next(filter(str.isupper, "".join(ts)))
+    if options.variable_order == "mrv":
+        unions = {x: consistency.length_bitmaps(index, values) for x, values in rs.items()}
+        var, rs = most_constrained(index, ts, rs, expansions, rs, unions)
+        if var is None:
+            log.info("Some variable has no feasible value left, not starting search.")
+            return False, None
+
+    positions = [None if options.propagation == "bitset" else -1] * len(ts)
+    starts = [dict(**expansions, **{var: x}) for x in rs[var]]
+    search = "{} engine, {} propagation, {} variable order, {} clause order".format(
+        options.engine, options.propagation, options.variable_order, options.clause_order)
 
-    log.info("Starting {} threads over {} starting points:".format(len(pool._pool), len(arguments)))
+    if processes == 0:
+        # One starting point after the other, without a pool or shared memory to set up
+        log.info("Searching {} starting points in-process ({}):".format(len(starts), search))
+        _init_search(index, ts, rs, None, options, None, None, None)
+        try:
+            return collect_results(index, ts, options, (_search(ts, rs, start, positions) for start in starts), len(starts))
+        finally:
+            _end_search()
 
-    # Cleanup done, start real algorithm
+    # Cancelling a portfolio member (see _cancel) must not interrupt setting up or cleaning up
+    # the pool and the shared instance (or the shared values, which are backed by a temporary
+    # file for a moment), so SIGTERM waits until they are done
+    signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    if progress is None:
+        progress = new_progress()
+    work_stealing = options.work_stealing and options.engine == "recursive"
+    hungry = multiprocessing.RawValue(ctypes.c_int) if work_stealing else None
+    pending = multiprocessing.Value(ctypes.c_int)
+    donations = multiprocessing.Queue()
+    instance = shared.SharedInstance.create(index, ts, rs)
+    pool = None
+    results = None
     try:
-        for n, _ in enumerate(pool.imap_unordered(__A, arguments)):
-            log.info("  Starting point {}/{} lead to a dead end".format(n+1, len(arguments)))
+        pool = multiprocessing.Pool(processes, initializer=_init_process,
+                                    initargs=(progress, instance.name, options, hungry, pending, donations))
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+        arguments = [instance.describe(ts, rs, start, positions) for start in starts]
+
+        log.info("Starting {} threads over {} starting points ({}{}):".format(
+            len(pool._pool), len(arguments), search, ", work stealing" if work_stealing else ""))
+
+        # Cleanup done, start real algorithm
+        if work_stealing:
+            results = run_tasks(pool, arguments, hungry, pending, donations)
+        else:
+            results = pool.imap_unordered(__A, arguments)
+        return collect_results(index, ts, options, results, len(arguments))
+    finally:
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        if work_stealing and results is not None:
+            results.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        instance.close()
+        instance.unlink()
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+
+
+def collect_results(index: SubstringIndex, ts: List[str], options: Options, results, num_starts: int) -> Tuple[bool, Dict]:
+    """
+    Go through the (stats, conflict) of the searches from all starting points as they finish,
+    until one of them raises ResultFound or all of them lead to a dead end.
+    """
+    stats = Counter()
+    try:
+        for n, (_stats, _conflict) in enumerate(results):
+            merge_stats(stats, _stats)
+            log.info("  Starting point {}/{} lead to a dead end after {} nodes".format(
+                n+1, num_starts + stats["donated"], _stats.get("nodes", 0)))
+            if options.backjumping and not _conflict:
+                log.info("  Conflict does not depend on any decision, so other starting points will fail too")
+                break
     except ResultFound as e:
+        merge_stats(stats, e.stats)
         log.info("Solution found. Checking..")
-        for old_clause in ts:
-            new_clause = old_clause
-            for var, replacement in e.replacements.items():
-                new_clause = new_clause.replace(var, replacement)
-            if new_clause in s:
-                log.info("  substring found: {} -> {}".format(old_clause, new_clause))
-            else:
-                log.error("  substring found: {} -> {}".format(old_clause, new_clause))
-                raise ValueError("substring not found, but A determined it valid. Bug!")
+        log_stats(stats)
+        verify(index, ts, e.replacements)
         return True, e.replacements
+
+    log.info("Search space exhausted.")
+    log_stats(stats)
+    return False, None
+
+
+def _cancel(signum, frame):
+    sys.exit(1)
+
+
+def _portfolio_member(n, s, ts, rs, index, options, processes, progress, results):
+    # Being cancelled should still run the cleanup in A, so our pool goes down with us
+    signal.signal(signal.SIGTERM, _cancel)
+    logging.getLogger().setLevel(logging.WARNING)
+    try:
+        results.put((n, A(s, ts, rs, index, options, processes, progress), None))
+    except Exception as e:
+        results.put((n, None, repr(e)))
+        raise
+
+
+def portfolio(s: str, ts: List[str], rs: Dict[str, List[str]], index: SubstringIndex, configs: List[Options],
+              progress: Progress=None) -> Tuple[Optional[bool], Dict]:
+    """
+    Race A with each of the given options, splitting the cores between them. With fewer cores
+    than configurations, only the first configurations are raced, one core each, so they do
+    not slow each other down. The first one to answer YES or NO wins, the others are cancelled. Only the winner is logged, besides
+    intermediate solutions printed by print_map, which all of them add to one progress (a new
+    one if not given). Answers None if none of them knows.
+    """
+    cores = multiprocessing.cpu_count()
+    if len(configs) > cores:
+        log.info("Only racing the first {} of {} configurations, one per core.".format(cores, len(configs)))
+        configs = configs[:cores]
+    processes = cores // len(configs)
+    if progress is None:
+        progress = new_progress()
+    results = multiprocessing.Queue()
+    members = [multiprocessing.Process(target=_portfolio_member, args=(n, s, ts, rs, index, options, processes, progress, results))
+               for n, options in enumerate(configs)]
+
+    log.info("Racing {} configurations with {} threads each:".format(len(configs), processes))
+    for n, options in enumerate(configs):
+        log.info("  {}: {}".format(n, describe_options(options)))
+
+    # Members share our resource tracker for their shared memory. Starting one themselves
+    # would unblock SIGTERM in the middle of A (see _cancel).
+    resource_tracker.ensure_running()
+    start = datetime.datetime.now()
+    for member in members:
+        member.start()
+
+    try:
+        unknown = False
+        for _ in members:
+            n, answer, error = results.get()
+            if error is not None:
+                log.warning("  Configuration {} failed: {}".format(n, error))
+                continue
+            if answer[0] is None:
+                log.info("  Configuration {} gave up, waiting for the others".format(n))
+                unknown = True
+                continue
+            log.info("Configuration {} ({}) answered {} first, after {}".format(
+                n, describe_options(configs[n]), "YES" if answer[0] else "NO", datetime.datetime.now() - start))
+            return answer
+        if unknown:
+            log.info("No configuration knows whether there is a solution.")
+            return None, None
+        raise RuntimeError("All configurations of the portfolio failed")
+    finally:
+        for member in members:
+            if member.is_alive():
+                member.terminate()
+        for member in members:
+            member.join(10)
+            if member.is_alive():
+                member.kill()
+                member.join()
+
+
+def solve_components(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], solve,
+                     progress: Progress=None) -> Tuple[Optional[bool], Dict]:
+    """
+    Solve the independent parts of the instance (see parser.decompose) one by one with
+    solve(ts, rs, progress), smallest first, stopping at the first one without a solution.
+    Returns the solutions of all parts merged, or None if it is unknown whether some part has
+    one (and no other part is known to have none).
+
+    If progress is given, intermediate answers are printed for the whole instance: those of a
+    part come with the solutions of the parts before it, and the first value of every other
+    variable.
+    """
+    components = sorted(parser.decompose(ts, rs), key=lambda component: (len(component[1]), len(component[0])))
+    fixed = {var: values[0] for var, values in rs.items()}
+    satisfied = 0
+    if len(components) == 1:
+        result, replacements = solve(*components[0], progress and progress._replace(fixed=fixed))
+        if not result:
+            return result, None
     else:
+        log.info("Split into {} independent components.".format(len(components)))
+        replacements = {}
+        unknown = False
+        for n, (_ts, _rs) in enumerate(components):
+            log.info("Component {}/{}: {} clauses and {} variables.".format(n+1, len(components), len(_ts), len(_rs)))
+            result, _replacements = solve(_ts, _rs, progress and progress._replace(fixed=dict(fixed), satisfied=satisfied))
+            if result is None:
+                log.info("Unknown whether component {} has a solution, going on with the others.".format(n+1))
+                unknown = True
+                continue
+            if not result:
+                log.info("Component {} has no solution, so neither has the instance.".format(n+1))
+                return False, None
+            replacements.update(_replacements)
+            fixed.update(_replacements)
+            satisfied += len(_ts)
+        if unknown:
+            return None, None
+
+    # Variables no clause mentions (see parser.substitute_fixed_variables) can take any value
+    for var, values in rs.items():
+        replacements.setdefault(var, values[0])
+    replacements = OrderedDict(sorted(replacements.items()))
+    if len(components) > 1:
+        log.info("Merged solutions of all components. Checking..")
+        verify(index, ts, replacements)
+    return True, replacements
+
+
+def solve(s: str, ts: List[str], rs: Dict[str, List[str]], index: SubstringIndex, options: Options=DEFAULT_OPTIONS,
+          processes: int=None, configs: List[Options]=None, results: ResultCache=None) -> Tuple[Optional[bool], Dict]:
+    """
+    Decide a parsed instance: filter the domains to arc consistency, then solve the components
+    one by one with A (see solve_components), or with a portfolio of configs if given. If
+    results is given, the result is looked up there first and stored there afterwards, unless
+    it is unknown.
+    """
+    if results is not None:
+        key = results.key(s, ts, rs)
+        result = results.get(key, index, ts)
+        if result is None:
+            result = solve(s, ts, rs, index, options, processes, configs)
+            if result[0] is not None:
+                results.put(key, *result)
+        return result
+
+    if not consistency.arc_consistency(index, ts, rs):
         return False, None
-    finally:
-        pool.terminate()
-        pool.join()
-    
+    progress = None if processes == 0 else new_progress()
+    if configs:
+        return solve_components(index, ts, rs, lambda _ts, _rs, _progress: portfolio(s, _ts, _rs, index, configs, _progress),
+                                progress)
+    return solve_components(index, ts, rs, lambda _ts, _rs, _progress: A(s, _ts, _rs, index, options, processes, _progress),
+                            progress)
+
+
+def load(filename: str, mapped: bool=False) -> Tuple[str, List[str], Dict[str, List[str]], SubstringIndex]:
+    """
+    Parsed instance and its index over s, from an SWE file, or from a .SWEB file written by
+    the compile subcommand (see shared.InstanceFile), which needs no parsing or indexing. If
+    mapped is set, s is left in the SWE file and searched in place (see haystack.HaystackIndex).
+    """
+    if filename.endswith(".SWEB"):
+        instance = shared.InstanceFile.open(filename)
+        log.info("Loaded compiled instance with {} clauses and {} variables.".format(len(instance.clauses), len(instance.domains)))
+        return instance.index.s, list(instance.clauses), OrderedDict(instance.domains), instance.index
+
+    if mapped:
+        s, ts, rs, occurrences = parser.parse_mapped(filename)
+        index = haystack.HaystackIndex(s)
+    else:
+        s, ts, rs, occurrences = parser.parse_file(filename)
+        index = SubstringIndex(s)
+    index.seed(occurrences)
+    return s, ts, rs, index
+
+
+def write_solution(filename: str, replacements: Dict[str, str]) -> str:
+    """Write replacements to the .SOL file belonging to the given .SWE (or .SWEB) file, returning its name"""
+    solution_filename = os.path.splitext(filename)[0] + ".SOL"
+    with open(solution_filename, "w") as solution_file:
+        for k, v in replacements.items():
+            solution_file.write("{}: {}\n".format(k, v))
+    return solution_filename
+
+
+def add_search_arguments(arg_parser: argparse.ArgumentParser):
+    """Command line options for the fields of Options"""
+    arg_parser.add_argument("--propagation", choices=CHOICES["propagation"], default=DEFAULT_OPTIONS.propagation,
+                            help="branch on clause positions, or track them all at once as bitsets")
+    arg_parser.add_argument("--variable-order", choices=CHOICES["variable_order"], default=DEFAULT_OPTIONS.variable_order,
+                            help="branch on variables in clause order, or on the one with the fewest feasible values")
+    arg_parser.add_argument("--clause-order", choices=CHOICES["clause_order"], default=DEFAULT_OPTIONS.clause_order,
+                            help="work on clauses in parse order, or pick the most constrained clause at runtime")
+    arg_parser.add_argument("--backjumping", action="store_true",
+                            help="jump back to the decision responsible for a failure and learn nogoods")
+    arg_parser.add_argument("--memo-size", type=int, default=DEFAULT_OPTIONS.memo_size, metavar="MB",
+                            help="memory per worker for remembering clause feasibility and occurrence bitmaps, 0 to disable")
+    arg_parser.add_argument("--engine", choices=CHOICES["engine"], default=DEFAULT_OPTIONS.engine,
+                            help="search recursively, with an explicit stack and an undo trail, with a SAT solver, or "
+                                 "with local search (which cannot prove there is no solution)")
+    arg_parser.add_argument("--max-flips", type=int, default=DEFAULT_OPTIONS.max_flips, metavar="N",
+                            help="steps before local search gives up, 0 to never give up")
+    arg_parser.add_argument("--value-order", choices=CHOICES["value_order"], default=DEFAULT_OPTIONS.value_order,
+                            help="try replacements longest first, shortest first, or shuffled")
+    arg_parser.add_argument("--seed", type=int, default=DEFAULT_OPTIONS.seed,
+                            help="random seed for --value-order random and local search")
+    arg_parser.add_argument("--no-work-stealing", action="store_true",
+                            help="only search from the initial starting points, without idle workers taking over branches")
+
+
+def get_options(arg_parser: argparse.ArgumentParser, args) -> Options:
+    """Options given by the arguments added by add_search_arguments"""
+    options = Options(propagation=args.propagation, variable_order=args.variable_order, clause_order=args.clause_order,
+                      backjumping=args.backjumping, memo_size=args.memo_size, engine=args.engine,
+                      work_stealing=not args.no_work_stealing, value_order=args.value_order, seed=args.seed,
+                      max_flips=args.max_flips)
+    try:
+        return check_options(options)
+    except ValueError as e:
+        arg_parser.error(str(e))
+
+
+def check_options(options: Options) -> Options:
+    """Options, if they hold values the command line accepts and work together. Raises ValueError if not."""
+    for field, value in options._asdict().items():
+        default = getattr(DEFAULT_OPTIONS, field)
+        if field in CHOICES:
+            if value not in CHOICES[field]:
+                raise ValueError("{} must be one of {}, not {!r}".format(field, ", ".join(CHOICES[field]), value))
+        elif type(value) is not type(default):
+            raise ValueError("{} must be of type {}, not {!r}".format(field, type(default).__name__, value))
+    if options.engine != "recursive" and (options.variable_order, options.clause_order, options.backjumping) != ("static", "static", False):
+        raise ValueError("only the recursive engine supports other variable or clause orders, and backjumping")
+    return options
+
 
 if __name__ == '__main__':
     # Setup logging
     logging.basicConfig(format='[%(asctime)s] %(message)s')
     logging.getLogger().setLevel(logging.DEBUG)
 
-    # Get file from command line
-    filename = sys.argv[1]
+    if sys.argv[1:2] == ["compile"]:
+        arg_parser = argparse.ArgumentParser(prog="check.py compile", description="Simplify and index an SWE instance "
+                                             "once, and store it in a binary file check.py loads without parsing it.")
+        arg_parser.add_argument("filename")
+        arg_parser.add_argument("-o", "--output", metavar="FILE", help="where to write it, the .SWEB next to filename by default")
+        arg_parser.add_argument("--mmap", action="store_true",
+                                help="refer to s in the SWE file instead of copying it, and build no substring index")
+        args = arg_parser.parse_args(sys.argv[2:])
+        output = args.output or os.path.splitext(args.filename)[0] + ".SWEB"
+        s, ts, rs, index = load(args.filename, args.mmap)
+        size = shared.InstanceFile.create(output, index, ts, rs)
+        log.info("Compiled instance written to: {} ({} bytes)".format(output, size))
+        sys.exit()
+
+    # Get file and settings from command line
+    arg_parser = argparse.ArgumentParser(description="Decide whether the given SWE (or compiled .SWEB) instance has a "
+                                                     "solution. Run 'check.py compile' to compile one.")
+    arg_parser.add_argument("filename")
+    add_search_arguments(arg_parser)
+    arg_parser.add_argument("--portfolio", action="store_true",
+                            help="race the configuration given by the other options against a few others, on all cores")
+    arg_parser.add_argument("--dimacs", metavar="FILE", help="also write the instance as CNF to FILE, in DIMACS format")
+    arg_parser.add_argument("--enumerate", action="store_true", help="print all solutions to stdout instead of deciding")
+    arg_parser.add_argument("--count", action="store_true", help="count the solutions instead of deciding")
+    arg_parser.add_argument("--mmap", action="store_true",
+                            help="leave s in the file and search it in place, without building a substring index")
+    cache.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    options = get_options(arg_parser, args)
+
+    filename = args.filename
     start = datetime.datetime.now()
-    swe_lines = (l.strip() for l in open(filename))
-    s, ts, rs = parser.parse(swe_lines)
-    result, replacements = A(s, ts, rs)
+    s, ts, rs, index = load(filename, args.mmap)
+    if args.dimacs:
+        with open(args.dimacs, "w") as f:
+            cnf.Encoding(index, ts, rs).write_dimacs(f)
+        log.info("CNF written to: {}".format(args.dimacs))
+
+    if args.enumerate or args.count:
+        consistent = consistency.arc_consistency(index, ts, rs)
+        if args.enumerate:
+            n = 0
+            for n, solution in enumerate(counting.iter_solutions(index, ts, rs) if consistent else (), 1):
+                if n > 1:
+                    print("---")
+                for key, value in solution.items():
+                    print("{}:{}".format(key, value))
+            log.info("Enumerated {} solutions".format(n))
+        if args.count:
+            log.info("Number of solutions: {}".format(counting.count_solutions(index, ts, rs, args.memo_size) if consistent else 0))
+        log.info("Time taken: {}".format(datetime.datetime.now() - start))
+        sys.exit()
+
+    configs = [options] + [config for config in PORTFOLIO if config != options] if args.portfolio else None
+    result, replacements = solve(s, ts, rs, index, options, configs=configs, results=cache.from_arguments(args))
     end = datetime.datetime.now()
 
     if result is True:
-        solution_filename = filename.replace(".SWE", ".SOL")
-        solution_file = open(solution_filename, "w")
-
         log.info("Solution:")
         for k, v in replacements.items():
             log.info("  {} -> {}".format(k, v))
-            solution_file.write("{}: {}\n".format(k, v))
-        log.info("Solution written to: {}".format(solution_filename))
-        solution_file.close()
+        log.info("Solution written to: {}".format(write_solution(filename, replacements)))
+    elif result is None:
+        log.info("Unknown whether there is a solution")
     else:
         log.info("No solution found")
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import consistency
+import logging
+import sat
+
+from collections import OrderedDict, defaultdict
+from index import SubstringIndex
+from typing import Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class Encoding:
+    """
+    CNF encoding of an SWE instance:
+
+      * x(X, v) for every variable X and replacement v, exactly one of them true per X
+      * q(t, j, p) for every clause t: letter j of t is placed at position p of s. For j = 0
+        these select the placement of t, at least one of which must hold
+      * compatibility: if letter j is placed at p, then the letter after it is placed right
+        after its expansion. For variables this reads q(t, j, p) & x(X, v) -> q(t, j+1, p+|v|),
+        and q(t, j, p) requires X to take one of the values occurring at p
+
+    Only positions that the bitset relaxation of consistency deems reachable get a variable.
+    """
+
+    def __init__(self, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]):
+        self.num_vars = 0
+        self.clauses = []
+        self.choices = OrderedDict()
+
+        for var, values in rs.items():
+            for value in values:
+                self.choices[var, value] = self._new_var()
+            self._exactly_one([self.choices[var, value] for value in values])
+
+        # Which values of each variable occur at each position
+        occurring = {var: defaultdict(list) for var in rs}
+        for var, values in rs.items():
+            for value in values:
+                for p in index.find_all(value):
+                    occurring[var][p].append(value)
+
+        unions = {var: consistency.length_bitmaps(index, values) for var, values in rs.items()}
+        for t in ts:
+            self._encode_clause(index, t, occurring, unions)
+
+    def _new_var(self) -> int:
+        self.num_vars += 1
+        return self.num_vars
+
+    def _exactly_one(self, xs: List[int]):
+        self.clauses.append(list(xs))
+        if len(xs) <= 6:
+            for i, x in enumerate(xs):
+                for y in xs[i+1:]:
+                    self.clauses.append([-x, -y])
+            return
+
+        # Sequential counter: s_i is true if any of x_0..x_i is
+        s = [self._new_var() for _ in xs[:-1]]
+        for i, x in enumerate(xs[:-1]):
+            self.clauses.append([-x, s[i]])
+            if i:
+                self.clauses.append([-s[i-1], s[i]])
+                self.clauses.append([-x, -s[i-1]])
+        self.clauses.append([-xs[-1], -s[-1]])
+
+    def _encode_clause(self, index: SubstringIndex, t: str, occurring, unions):
+        m = len(t)
+        forwards = [index.everywhere]
+        for letter in t:
+            forwards.append(consistency.forward(index, forwards[-1], letter, unions))
+        backwards = [(1 << (len(index) + 1)) - 1]
+        for letter in reversed(t):
+            backwards.append(consistency.backward(index, backwards[-1], letter, unions))
+        backwards.reverse()
+
+        q = [{p: self._new_var() for p in consistency.bits(forwards[j] & backwards[j])} for j in range(m)]
+        self.clauses.append(list(q[0].values()))
+
+        for j, letter in enumerate(t):
+            last = j + 1 == m
+            for p, here in q[j].items():
+                if letter.islower():
+                    if not last:
+                        self.clauses.append([-here, q[j+1][p+1]])
+                    continue
+
+                candidates = [v for v in occurring[letter][p] if last or p + len(v) in q[j+1]]
+                self.clauses.append([-here] + [self.choices[letter, v] for v in candidates])
+                if not last:
+                    for v in candidates:
+                        self.clauses.append([-here, -self.choices[letter, v], q[j+1][p+len(v)]])
+
+    def decode(self, model: List[bool]) -> Dict[str, str]:
+        return OrderedDict(sorted((var, value) for (var, value), x in self.choices.items() if model[x]))
+
+    def write_dimacs(self, f):
+        comments = ["{}={} is variable {}".format(var, value, x) for (var, value), x in self.choices.items()]
+        sat.write_dimacs(f, self.num_vars, self.clauses, comments)
+
+
+def solve(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> Optional[Dict[str, str]]:
+    """Solve the instance with the CDCL solver. Returns the replacements, or None if there is no solution."""
+    encoding = Encoding(index, ts, rs)
+    log.info("Encoded as CNF with {} variables and {} clauses.".format(encoding.num_vars, len(encoding.clauses)))
+
+    solver = sat.Solver(encoding.num_vars)
+    for clause in encoding.clauses:
+        if not solver.add_clause(clause):
+            break
+    result = solver.solve()
+
+    log.info("SAT solver statistics:")
+    for key, value in sorted(solver.stats.items()):
+        log.info("  {}: {}".format(key, value))
+
+    return encoding.decode(solver.model) if result else None
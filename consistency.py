@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+import logging
+import memo
+
+from collections import Counter, defaultdict, deque
+from index import SubstringIndex
+from typing import Dict, List, Optional, Set
+
+log = logging.getLogger(__name__)
+
+# Bytes of a bitmap bits looks at a time
+BITS_CHUNK = 1 << 12
+
+
+def bits(bitmap: int):
+    """Positions of the set bits of bitmap, in ascending order"""
+    # A chunk at a time, as the digits of a bitmap over s as a whole would take len(s) bytes twice
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for start in range(0, len(data), BITS_CHUNK):
+        digits = bin(int.from_bytes(data[start:start+BITS_CHUNK], "little"))[:1:-1]
+        position = digits.find("1")
+        while position >= 0:
+            yield 8 * start + position
+            position = digits.find("1", position + 1)
+
+
+def length_bitmaps(index: SubstringIndex, values: List[str]) -> Dict[int, int]:
+    """Occurrences of the given values, grouped by length: length -> union of their bitmaps"""
+    lengths = defaultdict(list)
+    for value in values:
+        lengths[len(value)].append(value)
+    return {length: index.union_bitmap(group) for length, group in lengths.items()}
+
+
+class LengthBitmaps:
+    """
+    length_bitmaps of the variables in domains, made the first time they are asked for
+    rather than up front, as each takes len(s) / 8 bytes per length. About max_bytes worth
+    of them is remembered, dropping the least recently used ones.
+    """
+
+    def __init__(self, index: SubstringIndex, domains: Dict[str, List[str]], max_bytes: int):
+        self.index = index
+        self.domains = domains
+        self._unions = memo.TranspositionTable(max_bytes, Counter())
+
+    def __getitem__(self, var: str) -> Dict[int, int]:
+        unions = self._unions.get(var)
+        if unions is memo.MISSING:
+            unions = length_bitmaps(self.index, self.domains[var])
+            self._unions.put(var, unions)
+        return unions
+
+
+def forward(index: SubstringIndex, frontier: int, literal: str, unions: Dict[str, Dict[int, int]]) -> int:
+    """
+    Move a frontier (bitset of positions where the matched part of a clause can end) past
+    literal. Unassigned variables may take any value of their domain, given as length bitmaps.
+    """
+    if literal.isupper():
+        result = 0
+        for length, bitmap in unions[literal].items():
+            result |= (frontier & bitmap) << length
+        return result
+    return (frontier & index.bitmap(literal)) << len(literal)
+
+
+def backward(index: SubstringIndex, frontier: int, literal: str, unions: Dict[str, Dict[int, int]]) -> int:
+    """Mirror image of forward: frontier holds the positions where the rest of a clause can start"""
+    if literal.isupper():
+        result = 0
+        for length, bitmap in unions[literal].items():
+            result |= bitmap & (frontier >> length)
+        return result
+    return index.bitmap(literal) & (frontier >> len(literal))
+
+
+def walk(index: SubstringIndex, literals, unions: Dict[str, Dict[int, int]]) -> int:
+    """Positions where a clause, given as a sequence of literals, can end. Zero if it cannot be placed."""
+    frontier = index.everywhere
+    for literal in literals:
+        frontier = forward(index, frontier, literal, unions)
+        if not frontier:
+            break
+    return frontier
+
+
+def clause_supports(index: SubstringIndex, clause: str, rs: Dict[str, List[str]],
+                    unions: Dict[str, Dict[int, int]]) -> Optional[Dict[str, Set[str]]]:
+    """
+    Values of each variable in clause for which the clause can still be placed in s, or
+    None if it cannot be placed at all. The clause may also be given as a sequence of
+    literals, some of them replacements of variables that have been assigned already.
+
+    Supports are exact for variables occurring once in the clause, given the domains of
+    the other variables. Only when some other variable occurs more than once they are an
+    over-approximation: each of its occurrences is then allowed a value of its own.
+    """
+    m = len(clause)
+    forwards = [index.everywhere]
+    for letter in clause:
+        forwards.append(forward(index, forwards[-1], letter, unions))
+    if not forwards[m]:
+        return None
+
+    backwards = [0] * m + [(1 << (len(index) + 1)) - 1]
+    for j in reversed(range(m)):
+        backwards[j] = backward(index, backwards[j+1], clause[j], unions)
+
+    counts = Counter(filter(str.isupper, clause))
+    supported = {}
+    for j, letter in enumerate(clause):
+        if counts[letter] == 1:
+            # A value fits if it occurs somewhere the prefix can end and the suffix can start
+            supported[letter] = {v for v in rs[letter] if forwards[j] & index.bitmap(v) & (backwards[j+1] >> len(v))}
+
+    for var, count in counts.items():
+        if count > 1:
+            # All occurrences must take the same value, so walk the clause once per value
+            supported[var] = {v for v in rs[var] if walk(index, [v if l == var else l for l in clause], unions)}
+
+    return supported
+
+
+def arc_consistency(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> bool:
+    """
+    Remove values from rs (in place) that some clause cannot support, until nothing changes.
+    Returns False if this proves the instance has no solution.
+    """
+    sizes = {var: len(values) for var, values in rs.items()}
+    unions = {var: length_bitmaps(index, values) for var, values in rs.items()}
+
+    watches = defaultdict(list)
+    for t in ts:
+        for var in set(filter(str.isupper, t)):
+            watches[var].append(t)
+
+    queue = deque(ts)
+    queued = set(ts)
+    consistent = True
+
+    while queue:
+        clause = queue.popleft()
+        queued.discard(clause)
+
+        supported = clause_supports(index, clause, rs, unions)
+        if supported is None:
+            log.info("Clause {} cannot be placed in s.".format(clause))
+            consistent = False
+            break
+
+        repeats = len(set(filter(str.isupper, clause))) < sum(map(str.isupper, clause))
+        for var, values in supported.items():
+            if len(values) == len(rs[var]):
+                continue
+
+            rs[var] = [v for v in rs[var] if v in values]
+            if not rs[var]:
+                log.info("No value of {} fits clause {}.".format(var, clause))
+                consistent = False
+                break
+
+            unions[var] = length_bitmaps(index, rs[var])
+            for t in watches[var]:
+                if t not in queued and (t != clause or repeats):
+                    queue.append(t)
+                    queued.add(t)
+
+        if not consistent:
+            break
+
+    log.info("Arc consistency removed {} of {} values:".format(
+        sum(sizes.values()) - sum(map(len, rs.values())), sum(sizes.values())))
+    for var, values in rs.items():
+        log.info("  {}: {} -> {}".format(var, sizes[var], len(values)))
+
+    return consistent
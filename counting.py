@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import consistency
+import logging
+import memo
+
+from collections import Counter, OrderedDict, defaultdict
+from index import SubstringIndex
+from typing import Dict, FrozenSet, Iterator, List, Tuple
+
+log = logging.getLogger(__name__)
+
+# A clause under a partial assignment: a tuple of literals, each either a variable or a
+# maximal run of lowercase letters (so equal clauses look equal, however they were assigned)
+Literals = Tuple[str, ...]
+
+
+def literals(t: str) -> Literals:
+    return substitute(tuple(t), None, None)
+
+
+def substitute(clause: Literals, var, value: str) -> Literals:
+    """clause with var replaced by value, merging runs of lowercase letters"""
+    result = []
+    for literal in clause:
+        if literal == var:
+            literal = value
+        if literal.islower() and result and result[-1].islower():
+            result[-1] += literal
+        else:
+            result.append(literal)
+    return tuple(result)
+
+
+def assigned(clause: Literals) -> bool:
+    return len(clause) == 1 and clause[0].islower()
+
+
+def feasible(index: SubstringIndex, clause: Literals, unions) -> bool:
+    """False if clause can no longer be placed in s, exact once all of its variables are assigned"""
+    if assigned(clause):
+        return clause[0] in index
+    return bool(consistency.walk(index, clause, unions))
+
+
+def _assign(index: SubstringIndex, clauses, var: str, value: str, unions):
+    """Clauses left after assigning value to var (satisfied ones are dropped), or None on a conflict"""
+    result = []
+    for clause in clauses:
+        if var in clause:
+            clause = substitute(clause, var, value)
+            if not feasible(index, clause, unions):
+                return None
+            if assigned(clause):
+                continue
+        result.append(clause)
+    return result
+
+
+def iter_solutions(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> Iterator[Dict[str, str]]:
+    """
+    All assignments of the variables in rs that satisfy every clause, one at a time. Only the
+    current branch of the search is kept in memory.
+    """
+    unions = {var: consistency.length_bitmaps(index, values) for var, values in rs.items()}
+    clauses = [literals(t) for t in ts]
+    if not all(feasible(index, clause, unions) for clause in clauses):
+        return
+
+    # Variables in the order they occur in the clauses, then the ones that do not occur at all
+    order = list(OrderedDict.fromkeys(l for t in ts for l in t if l.isupper() and l in rs))
+    order += [var for var in rs if var not in order]
+
+    def search(clauses, depth, assignment):
+        if depth == len(order):
+            yield OrderedDict(sorted(assignment.items()))
+            return
+
+        var = order[depth]
+        for value in rs[var]:
+            _clauses = _assign(index, clauses, var, value, unions)
+            if _clauses is not None:
+                assignment[var] = value
+                yield from search(_clauses, depth + 1, assignment)
+                del assignment[var]
+
+    yield from search([clause for clause in clauses if not assigned(clause)], 0, {})
+
+
+def components(clauses) -> List[FrozenSet[Literals]]:
+    """Split clauses into groups that share no variables"""
+    by_var = defaultdict(list)
+    for clause in clauses:
+        for literal in clause:
+            if literal.isupper():
+                by_var[literal].append(clause)
+
+    groups = []
+    seen = set()
+    for clause in clauses:
+        if clause in seen:
+            continue
+        group = {clause}
+        todo = [clause]
+        while todo:
+            for var in filter(str.isupper, todo.pop()):
+                for other in by_var.pop(var, ()):
+                    if other not in group:
+                        group.add(other)
+                        todo.append(other)
+        seen |= group
+        groups.append(frozenset(group))
+    return groups
+
+
+def count_solutions(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], memo_size: int=64) -> int:
+    """
+    Number of assignments of the variables in rs that satisfy every clause, without listing
+    them. Clauses that share no unassigned variables are counted separately and their counts
+    multiplied. Counts of such components are remembered (in about memo_size megabytes), so
+    a component that shows up again under another partial assignment is counted only once.
+    """
+    stats = Counter()
+    table = memo.TranspositionTable(memo_size * 2**20, stats)
+    unions = {var: consistency.length_bitmaps(index, values) for var, values in rs.items()}
+
+    def count(clauses) -> int:
+        total = 1
+        for component in components(clauses):
+            total *= count_component(component)
+            if not total:
+                break
+        return total
+
+    def count_component(component: FrozenSet[Literals]) -> int:
+        total = table.get(component)
+        if total is not memo.MISSING:
+            return total
+
+        # Branch on the variable occurring in most clauses, to split the component quickly
+        occurrences = Counter(var for clause in component for var in set(filter(str.isupper, clause)))
+        var = max(occurrences, key=lambda x: (occurrences[x], -len(rs[x]), x))
+        stats["branches"] += 1
+
+        total = 0
+        for value in rs[var]:
+            clauses = _assign(index, component, var, value, unions)
+            if clauses is not None:
+                total += count(set(clauses))
+
+        table.put(component, total)
+        return total
+
+    clauses = {literals(t) for t in ts}
+    if not all(feasible(index, clause, unions) for clause in clauses):
+        return 0
+
+    total = count({clause for clause in clauses if not assigned(clause)})
+
+    # Variables no clause mentions can take any of their values
+    mentioned = {l for t in ts for l in t if l.isupper()}
+    for var, values in rs.items():
+        if var not in mentioned:
+            total *= len(values)
+
+    log.info("Counted {} solutions:".format(total))
+    for key, value in sorted(stats.items()):
+        log.info("  {}: {}".format(key, value))
+    return total
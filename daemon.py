@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+import argparse
+import batch
+import cache
+import check
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+
+from cache import ResultCache
+from multiprocessing import connection
+from typing import Callable, Dict
+
+log = logging.getLogger(__name__)
+
+# How often a request waiting for its worker checks whether it was cancelled, in seconds
+CANCEL_INTERVAL = 0.05
+
+
+def _serve(conn, results: ResultCache=None):
+    """Body of a worker process: solve the instances sent over conn, one at a time"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        for name, text, options in iter(conn.recv, None):
+            conn.send(batch.solve_instance(name, text, options, results))
+    except EOFError:
+        pass
+
+
+class Worker:
+    """Worker process, started ahead of time with everything imported, see Solver"""
+
+    def __init__(self, context, results: ResultCache=None):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, results), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class Solver:
+    """
+    Worker processes shared by concurrent requests, each solving one instance at a time (see
+    batch.solve_instance). Requests wait for a free worker. When a request runs out of time or
+    is cancelled, its worker is killed and a fresh one takes its place, so a long search never
+    holds up later requests.
+
+    Workers are forked from this process, so they start out with everything imported. The
+    ones started later are forked while other threads are handling requests, which is fine as
+    workers only use the solver and logging (which takes care of its own locks).
+    """
+
+    def __init__(self, processes: int=None, options: check.Options=check.DEFAULT_OPTIONS, results: ResultCache=None):
+        self.options = options
+        self.results = results
+        self.context = multiprocessing.get_context("fork")
+        self.idle = queue.Queue()
+        self.workers = set()
+        self.lock = threading.Lock()
+        for _ in range(processes or os.cpu_count()):
+            self._replace(None)
+
+    def _replace(self, worker: Worker=None):
+        """Stop worker (if any) and start a fresh one in its place"""
+        if worker is not None:
+            worker.stop()
+        worker = Worker(self.context, self.results)
+        with self.lock:
+            self.workers.add(worker)
+        self.idle.put(worker)
+
+    def _retire(self, worker: Worker):
+        """Replace worker in the background, so its request can be answered right away"""
+        with self.lock:
+            self.workers.discard(worker)
+        threading.Thread(target=self._replace, args=(worker,), daemon=True).start()
+
+    def _result(self, name: str, result: str, start: datetime.datetime) -> Dict:
+        return {"name": name, "result": result, "seconds": (datetime.datetime.now() - start).total_seconds()}
+
+    def solve(self, name: str, text: str, options: Dict=None, timeout: float=None,
+              cancelled: threading.Event=None) -> Dict:
+        """
+        Decide the instance in SWE text, with the search options overridden by the fields of
+        options. Returns the outcome as a JSON object (see batch.outcome_json), with result
+        TIMEOUT if it is not known within timeout seconds or CANCELLED once cancelled is set,
+        or ERROR if the options are not accepted (see check.check_options).
+        """
+        start = datetime.datetime.now()
+        deadline = None if timeout is None else start + datetime.timedelta(seconds=timeout)
+        cancelled = cancelled or threading.Event()
+        try:
+            options = check.check_options(self.options._replace(**(options or {})))
+        except (TypeError, ValueError) as e:
+            return batch.outcome_json(name, None, None, repr(e), datetime.datetime.now() - start)
+
+        def remaining():
+            if deadline is None:
+                return CANCEL_INTERVAL
+            return min(CANCEL_INTERVAL, (deadline - datetime.datetime.now()).total_seconds())
+
+        # Wait for a free worker
+        worker = None
+        while worker is None:
+            if cancelled.is_set():
+                return self._result(name, "CANCELLED", start)
+            if remaining() <= 0:
+                return self._result(name, "TIMEOUT", start)
+            try:
+                worker = self.idle.get(timeout=remaining())
+            except queue.Empty:
+                pass
+
+        try:
+            worker.conn.send((name, text, options))
+            while not connection.wait([worker.conn, worker.process.sentinel], max(0, remaining())):
+                if cancelled.is_set() or remaining() <= 0:
+                    self._retire(worker)
+                    return self._result(name, "CANCELLED" if cancelled.is_set() else "TIMEOUT", start)
+            outcome = worker.conn.recv()
+        except (EOFError, OSError):
+            self._retire(worker)
+            return batch.outcome_json(name, None, None, "worker died", datetime.datetime.now() - start)
+
+        self.idle.put(worker)
+        return batch.outcome_json(*outcome)
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers:
+                worker.stop()
+            self.workers.clear()
+
+
+class Session:
+    """
+    Requests of a single client, one JSON object per line:
+
+      {"name": ..., "swe": ..., "timeout": ..., "options": {...}}  decide an instance, all but "swe" optional
+      {"cancel": name}                                              cancel an earlier request
+
+    Requests are handled concurrently, and every outcome is written as a JSON line as soon as
+    it is known (see batch.outcome_json).
+    """
+
+    def __init__(self, solver: Solver, write: Callable[[str], None]):
+        self.solver = solver
+        self.write = write
+        self.lock = threading.Lock()
+        self.cancelled = {}
+        self.threads = []
+        self.requests = 0
+
+    def handle(self, line: str):
+        if not line.strip():
+            return
+        self.requests += 1
+        try:
+            request = json.loads(line)
+            if "cancel" in request:
+                self.cancelled.get(str(request["cancel"]), threading.Event()).set()
+                return
+            name = str(request.get("name", self.requests))
+            text = request["swe"]
+        except (ValueError, KeyError, TypeError) as e:
+            self.respond(batch.outcome_json(str(self.requests), None, None, repr(e), datetime.timedelta()))
+            return
+
+        self.cancelled[name] = threading.Event()
+        thread = threading.Thread(target=self._solve, args=(name, text, request), daemon=True)
+        self.threads.append(thread)
+        thread.start()
+
+    def _solve(self, name: str, text: str, request: Dict):
+        self.respond(self.solver.solve(name, text, request.get("options"), request.get("timeout"), self.cancelled[name]))
+
+    def respond(self, outcome: Dict):
+        try:
+            with self.lock:
+                self.write(json.dumps(outcome) + "\n")
+        except OSError:
+            # The client is gone, so nobody is waiting for the other requests either
+            for cancelled in self.cancelled.values():
+                cancelled.set()
+
+    def join(self):
+        """Wait for all requests to be answered"""
+        for thread in self.threads:
+            thread.join()
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        def write(text):
+            self.wfile.write(text.encode())
+
+        session = Session(self.server.solver, write)
+        for line in self.rfile:
+            session.handle(line.decode())
+        session.join()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, solver: Solver):
+        self.solver = solver
+        super().__init__(path, Handler)
+
+
+def _stop(signum, frame):
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(message)s')
+    logging.getLogger().setLevel(logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description="Keep worker processes ready to decide SWE instances sent as JSON "
+                                                     "lines on stdin, or on a Unix socket (see Session).")
+    arg_parser.add_argument("--socket", metavar="PATH", help="listen on a Unix socket at PATH instead of reading stdin")
+    arg_parser.add_argument("--processes", type=int, help="number of worker processes, all cores if not given")
+    check.add_search_arguments(arg_parser)
+    cache.add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    options = check.get_options(arg_parser, args)
+
+    solver = Solver(args.processes, options, cache.from_arguments(args))
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+            with Server(args.socket, solver) as server:
+                log.info("Listening on {} with {} worker processes.".format(args.socket, len(solver.workers)))
+                try:
+                    server.serve_forever()
+                finally:
+                    os.unlink(args.socket)
+        else:
+            def write(text):
+                sys.stdout.write(text)
+                sys.stdout.flush()
+
+            log.info("Reading requests from stdin with {} worker processes.".format(len(solver.workers)))
+            session = Session(solver, write)
+            for line in sys.stdin:
+                session.handle(line)
+            session.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        solver.close()
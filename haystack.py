@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+import mmap
+import os
+import re
+
+from index import BITMAP_BYTES, SubstringIndex
+from typing import Iterator, List, Tuple
+
+# Letters decoded at a time when s is read from start to end
+CHUNK = 1 << 20
+
+
+def file_stamp(f) -> Tuple[int, int]:
+    """Size and modification time of an open file, which tell whether it was written to since"""
+    stat = os.fstat(f.fileno())
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Haystack:
+    """
+    s kept as ASCII bytes in a buffer, such as a file mapped into memory, instead of as a str.
+    Offers the few things the solver does with s itself: its length, reading it from start
+    to end (a chunk at a time), prefix checks at a position and looking for a substring, all
+    done on the buffer in place.
+
+    If the buffer is part of a file, source is (filename, start, end), so that other processes
+    can map the same file (see open) and share its pages with this one, and stamp is what
+    file_stamp said about the file when it was mapped.
+    """
+
+    def __init__(self, buf: memoryview, source: Tuple[str, int, int]=None, stamp: Tuple[int, int]=None):
+        self.buf = buf
+        self.source = source
+        self.stamp = stamp
+        self._encoded = {}
+
+    @classmethod
+    def open(cls, filename: str, start: int=0, end: int=None) -> "Haystack":
+        """s as the bytes from start to end (the end of the file by default) of a file"""
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stamp = file_stamp(f)
+        end = len(mapped) if end is None else end
+        return cls(memoryview(mapped)[start:end], (os.path.abspath(filename), start, end), stamp)
+
+    def __len__(self):
+        return len(self.buf)
+
+    def __iter__(self) -> Iterator[str]:
+        for start in range(0, len(self.buf), CHUNK):
+            yield from self.buf[start:start+CHUNK].tobytes().decode("ascii")
+
+    def __str__(self):
+        if self.source is None:
+            return "s ({} letters)".format(len(self))
+        return "s ({} letters in {})".format(len(self), self.source[0])
+
+    def _encode(self, sub: str) -> bytes:
+        try:
+            return self._encoded[sub]
+        except KeyError:
+            encoded = self._encoded[sub] = sub.encode("ascii")
+            return encoded
+
+    def startswith(self, sub: str, position: int) -> bool:
+        encoded = self._encode(sub)
+        return self.buf[position:position+len(encoded)] == encoded
+
+    def __contains__(self, sub: str) -> bool:
+        return re.search(re.escape(self._encode(sub)), self.buf) is not None
+
+    def find_all(self, sub: str) -> List[int]:
+        """All starting positions of sub, overlapping ones included, in ascending order"""
+        if not sub:
+            return list(range(len(self) + 1))
+        return [m.start() for m in re.finditer(b"(?=" + re.escape(self._encode(sub)) + b")", self.buf)]
+
+
+class HaystackIndex(SubstringIndex):
+    """
+    Substring index over a Haystack without a suffix automaton: lookups go to the buffer
+    directly (see Haystack), which costs a pass over s for every new pattern rather than time
+    proportional to the pattern, but needs no memory beyond s and the occurrences looked up.
+    Occurrences found in one pass for a whole instance (see seed) are used as they are.
+    """
+
+    def __init__(self, s: Haystack):
+        self.s = s
+        self._occurrences = {}
+        self.limit_bitmaps(BITMAP_BYTES)
+        self._present = {}
+
+    def __contains__(self, sub: str) -> bool:
+        if sub in self._occurrences:
+            return len(self._occurrences[sub]) > 0
+        try:
+            return self._present[sub]
+        except KeyError:
+            present = self._present[sub] = sub in self.s
+            return present
+
+    def _find_all(self, sub: str) -> List[int]:
+        return self.s.find_all(sub)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+import logging
+import memo
+
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List
+
+log = logging.getLogger(__name__)
+
+# Memory for the bitmaps an index remembers by default, see limit_bitmaps
+BITMAP_BYTES = 64 * 2**20
+
+
+class SubstringIndex:
+    """
+    Suffix automaton over s, so substring queries never have to rescan s.
+
+    Membership of a pattern costs O(|pattern|), enumerating all its occurrences
+    O(|pattern| + #occurrences). After construction the automaton is stored as
+    flat arrays: transitions in edge_start/edge_char/edge_to and the suffix link
+    tree (used to enumerate occurrences) in child_start/child.
+    """
+
+    # Arrays the automaton is stored in, with their type codes
+    ARRAYS = [("edge_start", "i"), ("edge_char", "B"), ("edge_to", "i"), ("child_start", "i"), ("child", "i"),
+              ("firstpos", "i"), ("origin", "b")]
+
+    def __init__(self, s: str):
+        self.s = s
+        self._occurrences = {}
+        self.limit_bitmaps(BITMAP_BYTES)
+
+        # Standard online construction, see Blumer et al. (1985)
+        nexts = [{}]
+        link = [-1]
+        length = [0]
+        firstpos = [-1]
+        origin = [0]
+        last = 0
+
+        for i, c in enumerate(s):
+            cur = len(length)
+            nexts.append({})
+            link.append(0)
+            length.append(length[last] + 1)
+            firstpos.append(i)
+            origin.append(1)
+
+            p = last
+            while p != -1 and c not in nexts[p]:
+                nexts[p][c] = cur
+                p = link[p]
+
+            if p != -1:
+                q = nexts[p][c]
+                if length[p] + 1 == length[q]:
+                    link[cur] = q
+                else:
+                    # Split q by cloning it. Clones do not mark an end position of their own.
+                    clone = len(length)
+                    nexts.append(nexts[q].copy())
+                    link.append(link[q])
+                    length.append(length[p] + 1)
+                    firstpos.append(firstpos[q])
+                    origin.append(0)
+                    while p != -1 and nexts[p].get(c) == q:
+                        nexts[p][c] = clone
+                        p = link[p]
+                    link[q] = link[cur] = clone
+
+            last = cur
+
+        # Freeze transitions into arrays
+        self.edge_start = array("i", [0])
+        self.edge_char = array("B")
+        self.edge_to = array("i")
+        for transitions in nexts:
+            for c, to in sorted(transitions.items()):
+                self.edge_char.append(ord(c))
+                self.edge_to.append(to)
+            self.edge_start.append(len(self.edge_to))
+
+        # Build the suffix link tree, children grouped per parent
+        children = [[] for _ in length]
+        for state, parent in enumerate(link):
+            if parent >= 0:
+                children[parent].append(state)
+        self.child_start = array("i", [0])
+        self.child = array("i")
+        for cs in children:
+            self.child.extend(cs)
+            self.child_start.append(len(self.child))
+
+        self.firstpos = array("i", firstpos)
+        self.origin = array("b", origin)
+
+        log.info("Indexed s with {} states and {} transitions.".format(len(length), len(self.edge_to)))
+
+    @classmethod
+    def from_arrays(cls, s: str, **arrays) -> "SubstringIndex":
+        """
+        Index over s from the arrays of an index built before (see ARRAYS), without building
+        the automaton again. Anything indexable like an array will do, such as a memoryview.
+        """
+        index = cls.__new__(cls)
+        index.s = s
+        index._occurrences = {}
+        index.limit_bitmaps(BITMAP_BYTES)
+        for name, _ in cls.ARRAYS:
+            setattr(index, name, arrays[name])
+        return index
+
+    def __len__(self):
+        return len(self.s)
+
+    def _state(self, sub: str) -> int:
+        """Walk the automaton along sub. Returns -1 if sub is not a substring of s."""
+        edge_start, edge_char, edge_to = self.edge_start, self.edge_char, self.edge_to
+        state = 0
+        for c in sub:
+            c = ord(c)
+            for e in range(edge_start[state], edge_start[state+1]):
+                if edge_char[e] == c:
+                    state = edge_to[e]
+                    break
+            else:
+                return -1
+        return state
+
+    def __contains__(self, sub: str) -> bool:
+        return self._state(sub) >= 0
+
+    def _find_all(self, sub: str) -> List[int]:
+        state = self._state(sub)
+        if state < 0:
+            return []
+
+        # Every non-cloned state below 'state' in the suffix link tree marks one end position
+        child_start, child, firstpos, origin = self.child_start, self.child, self.firstpos, self.origin
+        positions = []
+        stack = [state]
+        while stack:
+            state = stack.pop()
+            if origin[state]:
+                positions.append(firstpos[state] - len(sub) + 1)
+            stack.extend(child[child_start[state]:child_start[state+1]])
+        return sorted(positions)
+
+    def find_all(self, sub: str) -> Iterable[int]:
+        """All starting positions of sub in s, in ascending order. Cached per pattern."""
+        try:
+            return self._occurrences[sub]
+        except KeyError:
+            positions = self._occurrences[sub] = self._find_all(sub)
+            return positions
+
+    def seed(self, occurrences: Dict[str, Iterable[int]]):
+        """
+        Cache occurrence lists found elsewhere (see ahocorasick), pattern -> starting positions
+        in ascending order, so find_all does not have to look them up one by one.
+        """
+        self._occurrences.update(occurrences)
+
+    @property
+    def everywhere(self) -> int:
+        """Bitmap with a bit set for every position in s"""
+        return (1 << len(self.s)) - 1
+
+    def limit_bitmaps(self, max_bytes: int):
+        """
+        Remember about max_bytes worth of bitmaps at most, dropping the least recently used
+        ones, and none at all with 0. Each takes len(s) / 8 bytes. Forgets the ones remembered.
+        """
+        self._bitmaps = memo.TranspositionTable(max_bytes, Counter())
+
+    def bitmap(self, sub: str) -> int:
+        """Occurrences of sub as an integer: bit i is set iff sub occurs at position i. Cached per pattern."""
+        bitmap = self._bitmaps.get(sub)
+        if bitmap is not memo.MISSING:
+            return bitmap
+
+        bits = bytearray(len(self.s) // 8 + 1)
+        for i in self.find_all(sub):
+            bits[i >> 3] |= 1 << (i & 7)
+        bitmap = int.from_bytes(bits, "little")
+        self._bitmaps.put(sub, bitmap)
+        return bitmap
+
+    def union_bitmap(self, subs: Iterable[str]) -> int:
+        """
+        Occurrences of any of subs as an integer, see bitmap. Only bitmaps cached already are
+        used, the others are not made, so this takes no memory beyond the result.
+        """
+        result = 0
+        bits = bytearray(len(self.s) // 8 + 1)
+        for sub in subs:
+            bitmap = self._bitmaps.get(sub)
+            if bitmap is not memo.MISSING:
+                result |= bitmap
+                continue
+            for i in self.find_all(sub):
+                bits[i >> 3] |= 1 << (i & 7)
+        return result | int.from_bytes(bits, "little")
+
+    def startswith(self, sub: str, position: int) -> bool:
+        """Equivalent to s[position:].startswith(sub), without copying the tail of s."""
+        return self.s.startswith(sub, position)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import itertools
+import logging
+import random
+import scoring
+
+from collections import Counter, OrderedDict
+from index import SubstringIndex
+from typing import Callable, Dict, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+class LocalSearch:
+    """
+    Stochastic local search over complete assignments, maximizing the number of clauses
+    that occur in s. Every step picks a clause that does not occur and changes one of its
+    variables (WalkSAT): with probability noise to a random value, otherwise to the value
+    that satisfies the most clauses overall (min-conflicts). Changing a variable back to a
+    value it just had is tabu for tenure steps, unless that would beat the best score so far.
+    """
+
+    def __init__(self, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], seed: int=0,
+                 noise: float=0.2, tenure: int=10):
+        self.rs = rs
+        self.rng = random.Random(seed)
+        self.noise = noise
+        self.tenure = tenure
+        self.stats = Counter()
+
+        self.variables = [sorted(set(filter(str.isupper, t))) for t in ts]
+        self.assignment = OrderedDict((var, self.rng.choice(values)) for var, values in rs.items())
+        self.scorer = scoring.Scorer(index, ts, self.assignment)
+        self.unsatisfied = self.scorer.unsatisfied
+
+    @property
+    def score(self) -> int:
+        return self.scorer.score
+
+    def flip(self, var: str, value: str):
+        self.assignment[var] = value
+        self.scorer.assign(var, value)
+
+    def run(self, max_flips: int=0, improved: Callable[[Dict[str, str], int], None]=None) -> Optional[Dict[str, str]]:
+        """
+        Search until all clauses are satisfied, returning the assignment, or until max_flips
+        steps have been taken (0 for no limit), returning None. improved is called with every
+        assignment that satisfies more clauses than all before it.
+        """
+        if any(not self.variables[i] for i in self.unsatisfied):
+            log.info("Some clause without variables does not occur in s.")
+            return None
+
+        best = self.score
+        if improved is not None:
+            improved(self.assignment, best)
+        tabu = {}
+
+        for step in itertools.count():
+            if not self.unsatisfied:
+                return OrderedDict(sorted(self.assignment.items()))
+            if max_flips and step >= max_flips:
+                return None
+
+            variables = self.variables[self.rng.choice(self.unsatisfied)]
+            if self.rng.random() < self.noise:
+                var = self.rng.choice(variables)
+                values = [v for v in self.rs[var] if v != self.assignment[var]]
+                if not values:
+                    continue
+                value = self.rng.choice(values)
+                self.stats["random moves"] += 1
+            else:
+                moves = []
+                for var in variables:
+                    for value in self.rs[var]:
+                        if value == self.assignment[var]:
+                            continue
+                        delta = self.scorer.delta(var, value)
+                        if tabu.get((var, value), -1) >= step and self.score + delta <= best:
+                            continue
+                        moves.append((delta, var, value))
+                if not moves:
+                    self.stats["tabu blocked"] += 1
+                    continue
+                top = max(moves)[0]
+                _, var, value = self.rng.choice([move for move in moves if move[0] == top])
+                self.stats["greedy moves"] += 1
+
+            tabu[var, self.assignment[var]] = step + self.tenure
+            self.flip(var, value)
+            self.stats["flips"] += 1
+
+            if self.score > best:
+                best = self.score
+                if improved is not None:
+                    improved(self.assignment, best)
+
+
+def search(index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]], seed: int=0, max_flips: int=0,
+           improved: Callable[[Dict[str, str], int], None]=None) -> Optional[Dict[str, str]]:
+    """Run LocalSearch, see LocalSearch.run. Returns the replacements found, or None."""
+    searcher = LocalSearch(index, ts, rs, seed)
+    replacements = searcher.run(max_flips, improved)
+
+    log.info("Local search statistics:")
+    for key, value in sorted(searcher.stats.items()):
+        log.info("  {}: {}".format(key, value))
+    return replacements
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import sys
+
+from collections import Counter, OrderedDict
+
+MISSING = object()
+
+
+def sizeof(obj) -> int:
+    """Rough number of bytes held by obj, including the containers and strings inside it"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(map(sizeof, obj))
+    return size
+
+
+class TranspositionTable:
+    """
+    Memo table with least recently used eviction, holding about max_bytes worth of entries
+    at most. Hits, misses and evictions are counted in stats.
+    """
+
+    def __init__(self, max_bytes: int, stats: Counter):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.stats = stats
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """Value stored under key, or MISSING"""
+        try:
+            value, _ = self.entries[key]
+        except KeyError:
+            self.stats["memo misses"] += 1
+            return MISSING
+
+        self.entries.move_to_end(key)
+        self.stats["memo hits"] += 1
+        return value
+
+    def put(self, key, value):
+        size = sizeof(key) + sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = value, size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.bytes -= evicted
+            self.stats["memo evictions"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
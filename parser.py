@@ -1,10 +1,16 @@
 #!/usr/bin/env python3
+import ahocorasick
+import haystack
 import logging
+import mmap
+import os
+import re
 import string
 import sys
+from array import array
 from collections import OrderedDict
 
-from typing import Iterable, Tuple, Dict, List, Set
+from typing import BinaryIO, Iterable, Tuple, Dict, List, Set
 
 log = logging.getLogger(__name__)
 
@@ -12,6 +18,15 @@ LOWERCASE = set(string.ascii_lowercase)
 UPPERCASE = set(string.ascii_uppercase)
 ASCII_LETTERS = LOWERCASE | UPPERCASE
 
+# Validation of whole lines at once by parse_binary, in bytes
+LOWERCASE_LINE = re.compile(rb"[a-z]+")
+CLAUSE_LINE = re.compile(rb"[a-zA-Z]+")
+VALUES_LINE = re.compile(rb"[a-z]+(?:,[a-z]+)*")
+VARIABLE_LINE = re.compile(rb"[A-Z]:")
+
+# Buffer size parse_file reads files with
+CHUNK = 1 << 20
+
 
 def get_rs(rs: Iterable[str]) -> Iterable[Tuple[str, Set[str]]]:
     """Decode lines SWE lines containing the replacement mappings"""
@@ -29,31 +44,201 @@ def get_rs(rs: Iterable[str]) -> Iterable[Tuple[str, Set[str]]]:
         yield upper, set(lowers)
 
 
-def simplify_problem(s, ts, rs):
-    # We first simplify the solution somewhat. If something maps to a letter
-    # not present in s it will never be a suitable replacement.
-    remove = set()
-    for replacements in rs.values():
-        for replacement in replacements:
-            if replacement not in s:
-                remove.add(replacement)
-        replacements -= remove
+class Contradiction(Exception):
+    """Raised by a simplification when it finds the instance has no solution"""
+
+
+# Simplifications below take s, the clauses (a list), the domains (a dict of sets) and the
+# occurrence lists of the patterns of the instance before simplifying (see present), and
+# change the clauses and domains in place. They return how many clauses or values they
+# removed (or rewrote), zero meaning they changed nothing.
+
+def present(s, occurrences, sub: str) -> bool:
+    """Whether sub occurs in s, read from occurrences if it is one of the patterns in there"""
+    if sub in occurrences:
+        return len(occurrences[sub]) > 0
+    return sub in s
+
+
+def drop_long_replacements(s, ts, rs, occurrences) -> int:
+    """Replacements longer than s can never fit in it"""
+    removed = 0
+    for var, values in rs.items():
+        long = {v for v in values if len(v) > len(s)}
+        values -= long
+        removed += len(long)
+    return removed
+
+
+def drop_absent_replacements(s, ts, rs, occurrences) -> int:
+    """If something maps to a string not present in s it will never be a suitable replacement"""
+    removed = 0
+    for var, values in rs.items():
+        absent = {v for v in values if not present(s, occurrences, v)}
+        values -= absent
+        removed += len(absent)
+    return removed
 
-    # Remove all replacements not mentioned. For example, C is never mentioned
-    # in first example so it's a needless burden.
-    keep = set(filter(str.isupper, "".join(ts)))
-    remove = set(rs.keys()) - keep
-    for r in remove:
-        del rs[r]
+
+def check_absent_letters(s, ts, rs, occurrences) -> int:
+    """A clause with a letter that does not occur in s can never be satisfied"""
+    letters = {l for t in ts for l in t if l.islower()}
+    absent = {l for l in letters if not present(s, occurrences, l)}
+    for t in ts:
+        if any(l in absent for l in t):
+            raise Contradiction("Clause {} contains a letter that does not occur in s.".format(t))
+    return 0
+
+
+def check_constant_clauses(s, ts, rs, occurrences) -> int:
+    """Clauses without variables either occur in s, and can be left out, or they make the instance unsatisfiable"""
+    constant = [t for t in ts if t.islower()]
+    for t in constant:
+        if not present(s, occurrences, t):
+            raise Contradiction("Clause {} does not occur in s.".format(t))
+    ts[:] = [t for t in ts if not t.islower()]
+    return len(constant)
+
+
+def substitute_fixed_variables(s, ts, rs, occurrences) -> int:
+    """
+    Write out variables with a single value left in the clauses. They stay in rs, so they are
+    still part of the solution.
+    """
+    fixed = {var: next(iter(values)) for var, values in rs.items() if len(values) == 1}
+    substituted = ["".join(fixed.get(l, l) for l in t) for t in ts]
+    rewritten = sum(t != u for t, u in zip(ts, substituted))
+    ts[:] = substituted
+    return rewritten
+
+
+def filter_single_variable_clauses(s, ts, rs, occurrences) -> int:
+    """
+    A clause with one variable (maybe more than once) only allows the values that make it
+    occur in s. Restrict the domain to those and leave out the clause.
+    """
+    removed = 0
+    kept = []
+    for t in ts:
+        variables = set(filter(str.isupper, t))
+        if len(variables) != 1:
+            kept.append(t)
+            continue
+
+        var = variables.pop()
+        allowed = {v for v in rs[var] if present(s, occurrences, t.replace(var, v))}
+        removed += len(rs[var]) - len(allowed)
+        rs[var] &= allowed
+        if not allowed:
+            # The clause stays, as it is what makes the instance unsatisfiable
+            raise Contradiction("No value of {} fits clause {}.".format(var, t))
+        removed += 1
+    ts[:] = kept
+    return removed
+
+
+def drop_subsumed_clauses(s, ts, rs, occurrences) -> int:
+    """Clauses occurring within other clauses are satisfied along with them, as are duplicates"""
+    unique = list(OrderedDict.fromkeys(ts))
+
+    # All pieces of clauses as long as some shorter clause
+    lengths = set(map(len, unique))
+    pieces = set()
+    for t in unique:
+        for length in lengths:
+            if length < len(t):
+                pieces.update(t[i:i+length] for i in range(len(t) - length + 1))
+
+    kept = [t for t in unique if t not in pieces]
+    removed = len(ts) - len(kept)
+    ts[:] = kept
+    return removed
+
+
+def drop_unused_variables(s, ts, rs, occurrences) -> int:
+    """
+    Remove all variables not mentioned. For example, C is never mentioned in first example so
+    it's a needless burden. Only done before the other simplifications: variables whose clauses
+    they take away are still part of the solution.
+    """
+    mentioned = set(filter(str.isupper, "".join(ts)))
+    unused = [var for var in rs if var not in mentioned]
+    for var in unused:
+        del rs[var]
+    return len(unused)
+
+
+PASSES = [drop_long_replacements, drop_absent_replacements, check_absent_letters, check_constant_clauses,
+          substitute_fixed_variables, filter_single_variable_clauses, drop_subsumed_clauses]
+
+
+def simplify_problem(s, ts, rs, passes=PASSES) -> Tuple[str, List[str], Dict[str, Set[str]], Dict[str, array]]:
+    """
+    Run the simplifications in passes over the instance until none of them changes anything.
+    Stops early if one of them finds the instance has no solution, leaving in place the clause
+    that shows it, so the search will find out quickly too.
+
+    The patterns of the instance are looked up in s once beforehand (see ahocorasick), and the
+    simplifications read from those occurrence lists. Returns the simplified instance and the
+    lists of its patterns among them, for SubstringIndex.seed.
+    """
+    rs = OrderedDict((var, set(values)) for var, values in rs.items())
+    ts = list(ts)
+    stats = OrderedDict((simplification.__name__, 0) for simplification in [drop_unused_variables] + passes)
+    stats[drop_unused_variables.__name__] = drop_unused_variables(s, ts, rs, {})
+    occurrences = ahocorasick.occurrences(s, ts, rs)
+
+    try:
+        changed = True
+        while changed:
+            changed = False
+            for simplification in passes:
+                removed = simplification(s, ts, rs, occurrences)
+                stats[simplification.__name__] += removed
+                changed = changed or removed > 0
+    except Contradiction as e:
+        log.info(str(e))
 
     for k in list(rs.keys()):
         rs[k] = sorted(rs[k], key=lambda c: (-len(c), c))
 
-    log.info("Simplified to {k} clauses and {x} variables.".format(k=len(ts), x=len(rs)))
-    return s, ts, rs
+    log.info("Simplified to {k} clauses and {x} variables:".format(k=len(ts), x=len(rs)))
+    for name, removed in stats.items():
+        log.info("  {}: {}".format(name, removed))
+    patterns = OrderedDict((p, occurrences[p]) for p in ahocorasick.patterns(ts, rs) if p in occurrences)
+    return s, ts, rs, patterns
+
+
+def decompose(ts: List[str], rs: Dict[str, List[str]]) -> List[Tuple[List[str], Dict[str, List[str]]]]:
+    """
+    Split the instance into groups of clauses that share no variables, not even through other
+    clauses, each with the domains of its variables. The groups can be solved independently.
+    Clauses without variables form a group of their own.
+    """
+    # Union-find over variables: clauses join the variables they contain
+    parent = {var: var for var in rs}
 
+    def find(var):
+        while parent[var] != var:
+            parent[var] = parent[parent[var]]
+            var = parent[var]
+        return var
 
-def parse(swe_lines: Iterable[str]) -> Tuple[str, List[str], Dict[str, Set[str]]]:
+    for t in ts:
+        variables = [find(l) for l in t if l.isupper()]
+        for var in variables[1:]:
+            parent[find(var)] = find(variables[0])
+
+    groups = OrderedDict()
+    for i, t in enumerate(ts):
+        variables = [l for l in t if l.isupper()]
+        groups.setdefault(find(variables[0]) if variables else i, []).append(t)
+
+    return [(group, OrderedDict((var, values) for var, values in rs.items() if any(var in t for t in group)))
+            for group in groups.values()]
+
+
+def parse(swe_lines: Iterable[str]) -> Tuple[str, List[str], Dict[str, Set[str]], Dict[str, array]]:
     """Decode given SWE file and run the decision algorithm"""
     log.info("Parsing file..")
 
@@ -92,13 +277,105 @@ def parse(swe_lines: Iterable[str]) -> Tuple[str, List[str], Dict[str, Set[str]]
     return simplify_problem(s, ts, rs)
 
 
+def parse_binary(f: BinaryIO) -> Tuple[str, List[str], Dict[str, Set[str]], Dict[str, array]]:
+    """
+    Decode an SWE file opened in binary mode, like parse, but checking each line with a single
+    regular expression match rather than letter by letter, and without decoding the replacements
+    of variables no clause mentions (which simplify_problem would drop right away). Lines of
+    those variables are not checked beyond their first two characters.
+    """
+    log.info("Parsing file..")
+    lines = (line.strip() for line in f)
+
+    try:
+        k = int(next(lines))
+    except (ValueError, StopIteration):
+        raise ValueError("First line must contain an integer")
+
+    s = next(lines, b"")
+    if not LOWERCASE_LINE.fullmatch(s):
+        raise ValueError("String s should only contain lowercase letters")
+    return _parse_rest(s.decode("ascii"), k, lines)
+
+
+def parse_mapped(filename: str) -> Tuple[haystack.Haystack, List[str], Dict[str, Set[str]], Dict[str, array]]:
+    """
+    Decode the SWE file called filename like parse_file, except that s is left in the file:
+    it is mapped into memory and used in place as a Haystack, so it is never read into a str.
+    """
+    log.info("Parsing file, leaving s in place..")
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        stamp = haystack.file_stamp(f)
+    lines = (line.strip() for line in iter(mapped.readline, b""))
+
+    try:
+        k = int(next(lines))
+    except (ValueError, StopIteration):
+        raise ValueError("First line must contain an integer")
+
+    # s is the second line, without surrounding whitespace
+    start = mapped.tell()
+    end = mapped.find(b"\n", start)
+    end = len(mapped) if end < 0 else end
+    mapped.seek(min(end + 1, len(mapped)))
+    while start < end and mapped[start:start+1].isspace():
+        start += 1
+    while end > start and mapped[end-1:end].isspace():
+        end -= 1
+
+    s = haystack.Haystack(memoryview(mapped)[start:end], (os.path.abspath(filename), start, end), stamp)
+    if not LOWERCASE_LINE.fullmatch(s.buf):
+        raise ValueError("String s should only contain lowercase letters")
+    return _parse_rest(s, k, lines)
+
+
+def _parse_rest(s, k: int, lines: Iterable[bytes]) -> Tuple[str, List[str], Dict[str, Set[str]], Dict[str, array]]:
+    """Clauses and replacements after s, see parse_binary"""
+    ts = [next(lines, b"") for _ in range(k)]
+    ts_dedup = set(ts)
+    log.info("Found {} double clauses, removing duplicates..".format(len(ts) - len(ts_dedup)))
+    for t in ts_dedup:
+        if not CLAUSE_LINE.fullmatch(t):
+            raise ValueError("{} contained non-ascii chars".format(t.decode(errors="replace")))
+    ts = sorted((t.decode("ascii") for t in ts_dedup), key=lambda c: (-len(c), c))
+    mentioned = set(filter(str.isupper, "".join(ts)))
+
+    rs = {}
+    skipped = 0
+    for line in lines:
+        if not line:
+            continue
+        if not VARIABLE_LINE.match(line):
+            raise ValueError("First character of R should be uppercase")
+        var = chr(line[0])
+        if var not in mentioned:
+            skipped += 1
+            continue
+        if not VALUES_LINE.fullmatch(line, 2):
+            raise ValueError("All characters on RHS of R line should be lowercase")
+        rs[var] = line[2:].decode("ascii").split(",")
+    log.info("Skipped replacements of {} variables no clause mentions.".format(skipped))
+
+    for letter in sorted(mentioned - rs.keys()):
+        raise ValueError("{} not found in replacement mapping".format(letter))
+
+    return simplify_problem(s, ts, OrderedDict(sorted(rs.items())))
+
+
+def parse_file(filename: str) -> Tuple[str, List[str], Dict[str, Set[str]], Dict[str, array]]:
+    """Decode the SWE file called filename, see parse_binary"""
+    with open(filename, "rb", buffering=CHUNK) as f:
+        return parse_binary(f)
+
+
 if __name__ == '__main__':
     # Setup logging
     logging.basicConfig(format='[%(asctime)s] %(message)s')
     logging.getLogger().setLevel(logging.DEBUG)
 
     swe_lines = (l.strip() for l in open(sys.argv[1]))
-    s, ts, rs = parse(swe_lines)
+    s, ts, rs, _ = parse(swe_lines)
 
     log.info("String found: {}".format(s))
     log.info("Clauses found:")
@@ -108,4 +385,3 @@ if __name__ == '__main__':
     log.info("Possible expansions:")
     for k, expansions in rs.items():
         log.info("  {} -> {}".format(k, expansions))
-
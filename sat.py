@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+import heapq
+import logging
+
+from collections import Counter
+from typing import Iterable, List, TextIO
+
+log = logging.getLogger(__name__)
+
+
+def luby(i: int) -> int:
+    """i-th element (starting at 1) of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, ..."""
+    k = 1
+    while (1 << k) - 1 < i:
+        k += 1
+    while (1 << k) - 1 != i:
+        i -= (1 << (k - 1)) - 1
+        k = 1
+        while (1 << k) - 1 < i:
+            k += 1
+    return 1 << (k - 1)
+
+
+def write_dimacs(f: TextIO, num_vars: int, clauses: List[List[int]], comments: Iterable[str]=()):
+    """Write clauses (lists of non-zero integers, negative meaning negated) in DIMACS CNF format"""
+    for comment in comments:
+        f.write("c {}\n".format(comment))
+    f.write("p cnf {} {}\n".format(num_vars, len(clauses)))
+    for clause in clauses:
+        f.write(" ".join(map(str, clause)))
+        f.write(" 0\n")
+
+
+class Solver:
+    """
+    Conflict driven clause learning SAT solver. Variables are numbered from 1 and literals are
+    given as in DIMACS: v or -v. Internally literal v is 2v and -v is 2v+1, so that flipping the
+    lowest bit negates a literal.
+
+    Propagation uses two watched literals per clause: the first two of the clause. Conflicts
+    are analyzed up to the first unique implication point, the resulting clause is learned and
+    variables involved get their activity bumped. Decisions take the most active unassigned
+    variable with its last value (false, initially). Restarts follow the Luby sequence, and the least useful half
+    of the learned clauses is thrown away now and then.
+    """
+
+    def __init__(self, num_vars: int=0, restart_base: int=100, decay: float=0.95):
+        # Variable 0 does not exist, but keeping it in the arrays lets us index them directly
+        self.num_vars = 0
+        self.clauses = []
+        self.learnts = []
+        self.watches = [[], []]
+        self.value = [-1]
+        self.level = [0]
+        self.reason = [None]
+        self.phase = [0]
+        self.activity = [0.0]
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.heap = []
+        self.bump = 1.0
+        self.decay = decay
+        self.restart_base = restart_base
+        self.max_learnts = 1000
+        self.unsat = False
+        self.stats = Counter()
+        self.model = None
+        self.new_vars(num_vars)
+
+    def new_vars(self, n: int):
+        for _ in range(n):
+            self.num_vars += 1
+            self.watches.extend(([], []))
+            self.value.append(-1)
+            self.level.append(0)
+            self.reason.append(None)
+            self.phase.append(0)
+            self.activity.append(0.0)
+            heapq.heappush(self.heap, (0.0, self.num_vars))
+
+    def _lit_value(self, lit: int) -> int:
+        """1 if lit is true, 0 if it is false, -1 if unassigned"""
+        value = self.value[lit >> 1]
+        return value if value < 0 else value ^ (lit & 1)
+
+    def _enqueue(self, lit: int, reason) -> bool:
+        value = self._lit_value(lit)
+        if value >= 0:
+            return value == 1
+        var = lit >> 1
+        self.value[var] = 1 ^ (lit & 1)
+        self.level[var] = len(self.trail_lim)
+        self.reason[var] = reason
+        self.trail.append(lit)
+        return True
+
+    def add_clause(self, clause: Iterable[int]) -> bool:
+        """Add a clause of DIMACS literals. Returns False if the formula became unsatisfiable."""
+        if self.unsat:
+            return False
+
+        lits = set()
+        for l in clause:
+            lit = 2 * l if l > 0 else -2 * l + 1
+            if lit ^ 1 in lits:
+                return True
+            lits.add(lit)
+
+        # Drop literals that are false at the top level, skip clauses that are true already
+        lits = [lit for lit in lits if self._lit_value(lit) != 0]
+        if any(self._lit_value(lit) == 1 for lit in lits):
+            return True
+
+        if not lits:
+            self.unsat = True
+        elif len(lits) == 1:
+            self._enqueue(lits[0], None)
+            self.unsat = self._propagate() is not None
+        else:
+            self.watches[lits[0]].append(lits)
+            self.watches[lits[1]].append(lits)
+            self.clauses.append(lits)
+        return not self.unsat
+
+    def _propagate(self):
+        """Unit propagation over the trail. Returns a conflicting clause, or None."""
+        trail, watches, value = self.trail, self.watches, self.value
+
+        while self.qhead < len(trail):
+            false_lit = trail[self.qhead] ^ 1
+            self.qhead += 1
+            self.stats["propagations"] += 1
+
+            watching = watches[false_lit]
+            i = j = 0
+            while i < len(watching):
+                clause = watching[i]
+                i += 1
+
+                # Make sure the false literal is the second watch
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+
+                first = clause[0]
+                v = value[first >> 1]
+                if v >= 0 and v ^ (first & 1) == 1:
+                    watching[j] = clause
+                    j += 1
+                    continue
+
+                # Look for a new literal to watch
+                for k in range(2, len(clause)):
+                    lit = clause[k]
+                    v = value[lit >> 1]
+                    if v < 0 or v ^ (lit & 1) == 1:
+                        clause[1], clause[k] = lit, false_lit
+                        watches[lit].append(clause)
+                        break
+                else:
+                    watching[j] = clause
+                    j += 1
+                    if not self._enqueue(first, clause):
+                        # Conflict: keep the remaining watches and stop
+                        while i < len(watching):
+                            watching[j] = watching[i]
+                            i += 1
+                            j += 1
+                        del watching[j:]
+                        self.qhead = len(trail)
+                        return clause
+            del watching[j:]
+
+        return None
+
+    def _bump(self, var: int):
+        self.activity[var] += self.bump
+        if self.activity[var] > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.bump *= 1e-100
+            self.heap = [(-self.activity[v], v) for v in range(1, self.num_vars + 1) if self.value[v] < 0]
+            heapq.heapify(self.heap)
+        elif self.value[var] < 0:
+            heapq.heappush(self.heap, (-self.activity[var], var))
+
+    def _analyze(self, conflict):
+        """Learn a clause from a conflict (first unique implication point). Returns it with the level to go back to."""
+        seen = set()
+        learnt = [None]
+        counter = 0
+        lit = None
+        index = len(self.trail)
+        current = len(self.trail_lim)
+
+        while True:
+            for q in (conflict if lit is None else conflict[1:]):
+                var = q >> 1
+                if var in seen or self.level[var] == 0:
+                    continue
+                seen.add(var)
+                self._bump(var)
+                if self.level[var] == current:
+                    counter += 1
+                else:
+                    learnt.append(q)
+
+            # Continue with the most recent literal on the trail involved in the conflict
+            index -= 1
+            while self.trail[index] >> 1 not in seen:
+                index -= 1
+            lit = self.trail[index]
+            conflict = self.reason[lit >> 1]
+            counter -= 1
+            if not counter:
+                break
+
+            # Reasons have their implied literal first
+            if conflict[0] != lit:
+                k = conflict.index(lit)
+                conflict[0], conflict[k] = lit, conflict[0]
+
+        learnt[0] = lit ^ 1
+        self.bump /= self.decay
+
+        # Drop literals implied by the others (local minimization)
+        learnt = [learnt[0]] + [q for q in learnt[1:] if not self._redundant(q, seen)]
+
+        if len(learnt) == 1:
+            return learnt, 0
+
+        # The literal of the highest level goes second, so it is watched
+        k = max(range(1, len(learnt)), key=lambda k: self.level[learnt[k] >> 1])
+        learnt[1], learnt[k] = learnt[k], learnt[1]
+        return learnt, self.level[learnt[1] >> 1]
+
+    def _redundant(self, lit, seen) -> bool:
+        reason = self.reason[lit >> 1]
+        if reason is None:
+            return False
+        return all(q >> 1 in seen or self.level[q >> 1] == 0 for q in reason if q != lit ^ 1)
+
+    def _cancel_until(self, level: int):
+        if len(self.trail_lim) <= level:
+            return
+        start = self.trail_lim[level]
+        for lit in self.trail[start:]:
+            var = lit >> 1
+            self.phase[var] = self.value[var]
+            self.value[var] = -1
+            self.reason[var] = None
+            heapq.heappush(self.heap, (-self.activity[var], var))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+
+    def _reduce(self):
+        """Throw away the longer half of the learned clauses that are not currently a reason"""
+        locked = {id(self.reason[lit >> 1]) for lit in self.trail}
+        self.learnts.sort(key=len)
+        keep = self.learnts[:len(self.learnts) // 2]
+        drop = {id(c) for c in self.learnts[len(self.learnts) // 2:] if len(c) > 2 and id(c) not in locked}
+        keep.extend(c for c in self.learnts[len(self.learnts) // 2:] if id(c) not in drop)
+        self.learnts = keep
+        for watching in self.watches:
+            watching[:] = [c for c in watching if id(c) not in drop]
+        self.stats["deleted"] += len(drop)
+        self.max_learnts = int(self.max_learnts * 1.1)
+
+    def _decide(self) -> int:
+        """Most active unassigned variable, as a literal with its saved phase. 0 if all are assigned."""
+        while self.heap:
+            _, var = heapq.heappop(self.heap)
+            if self.value[var] < 0:
+                return 2 * var + (self.phase[var] ^ 1)
+        return 0
+
+    def solve(self) -> bool:
+        """Decide satisfiability. On success, model[v] holds the value of variable v."""
+        if self.unsat or self._propagate() is not None:
+            self.unsat = True
+            return False
+
+        self.max_learnts = max(self.max_learnts, len(self.clauses) // 3)
+        restarts = 0
+        while True:
+            restarts += 1
+            budget = self.restart_base * luby(restarts)
+            self.stats["restarts"] += 1
+
+            while True:
+                conflict = self._propagate()
+                if conflict is not None:
+                    self.stats["conflicts"] += 1
+                    if not self.trail_lim:
+                        self.unsat = True
+                        return False
+
+                    learnt, level = self._analyze(conflict)
+                    self._cancel_until(level)
+                    if len(learnt) == 1:
+                        self._enqueue(learnt[0], None)
+                    else:
+                        self.watches[learnt[0]].append(learnt)
+                        self.watches[learnt[1]].append(learnt)
+                        self.learnts.append(learnt)
+                        self.stats["learned"] += 1
+                        self._enqueue(learnt[0], learnt)
+
+                    budget -= 1
+                    continue
+
+                if budget <= 0:
+                    self._cancel_until(0)
+                    break
+
+                if len(self.learnts) - len(self.trail) >= self.max_learnts:
+                    self._reduce()
+
+                lit = self._decide()
+                if not lit:
+                    self.model = [v == 1 for v in self.value]
+                    self._cancel_until(0)
+                    return True
+
+                self.stats["decisions"] += 1
+                self.trail_lim.append(len(self.trail))
+                self._enqueue(lit, None)
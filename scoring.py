@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+from index import SubstringIndex
+from typing import Dict, List, Optional
+
+
+class Scorer:
+    """
+    Number of clauses that occur in s under an assignment, kept up to date as the assignment
+    changes. An inverted index from variables to the clauses they occur in means changing a
+    variable only re-checks those clauses. Clauses with an unassigned variable do not count.
+
+    The clauses that do not occur are kept in unsatisfied (in no particular order), so one
+    can be picked at random in constant time.
+    """
+
+    def __init__(self, index: SubstringIndex, ts: List[str], assignment: Dict[str, str]=None):
+        self.index = index
+        self.ts = ts
+        self.assignment = {}
+        self.occurs = {}
+        for i, t in enumerate(ts):
+            for var in set(filter(str.isupper, t)):
+                self.occurs.setdefault(var, []).append(i)
+
+        self.score = 0
+        self.satisfied = [False] * len(ts)
+        self.unsatisfied = list(range(len(ts)))
+        self.where = {i: i for i in range(len(ts))}
+        for i, t in enumerate(ts):
+            if t.islower():
+                self._set(i, t in index)
+        if assignment:
+            self.update(assignment)
+
+    def _check(self, i: int, var: str=None, value: str=None) -> bool:
+        """Whether clause i occurs, with var assigned value instead of its current value"""
+        expanded = []
+        for l in self.ts[i]:
+            if l == var:
+                l = value
+            elif l.isupper():
+                l = self.assignment.get(l)
+            if l is None:
+                return False
+            expanded.append(l)
+        return "".join(expanded) in self.index
+
+    def _set(self, i: int, satisfied: bool):
+        if satisfied == self.satisfied[i]:
+            return
+        self.satisfied[i] = satisfied
+        if satisfied:
+            self.score += 1
+            last = self.unsatisfied.pop()
+            if last != i:
+                self.unsatisfied[self.where[i]] = last
+                self.where[last] = self.where[i]
+            del self.where[i]
+        else:
+            self.score -= 1
+            self.where[i] = len(self.unsatisfied)
+            self.unsatisfied.append(i)
+
+    def delta(self, var: str, value: Optional[str]) -> int:
+        """Change in score if var were assigned value (None for unassigned), without assigning it"""
+        return sum(self._check(i, var, value) - self.satisfied[i] for i in self.occurs.get(var, ()))
+
+    def assign(self, var: str, value: Optional[str]):
+        """Assign value to var (None to unassign it) and update the score"""
+        if value is None:
+            self.assignment.pop(var, None)
+        else:
+            self.assignment[var] = value
+        for i in self.occurs.get(var, ()):
+            self._set(i, self._check(i))
+
+    def update(self, assignment: Dict[str, str]):
+        """Make the assignment equal to the variables in assignment, re-checking only clauses that changed"""
+        changed = set()
+        for var in self.occurs:
+            value = assignment.get(var)
+            if value != self.assignment.get(var):
+                if value is None:
+                    del self.assignment[var]
+                else:
+                    self.assignment[var] = value
+                changed.update(self.occurs[var])
+        for i in changed:
+            self._set(i, self._check(i))
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+import ahocorasick
+import haystack
+import json
+import logging
+import mmap
+import string
+
+from array import array
+from collections import OrderedDict
+from index import SubstringIndex
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+log = logging.getLogger(__name__)
+
+LOWERCASE = string.ascii_lowercase
+
+
+def _starts(strings: List[str]) -> array:
+    """Start offsets of strings stored back to back, followed by the end of the last one"""
+    starts = array("i", [0])
+    for string_ in strings:
+        starts.append(starts[-1] + len(string_))
+    return starts
+
+
+def _split(data, starts) -> List[str]:
+    text = bytes(data).decode("ascii")
+    return [text[a:b] for a, b in zip(starts, starts[1:])]
+
+
+class CompiledInstance:
+    """
+    SWE instance compiled into a single buffer, used in place. The buffer holds s, the
+    clauses, the replacements of every variable, the arrays of the substring index over s and
+    the occurrence lists of the patterns the search looks up (see ahocorasick.patterns).
+    Strings and lists are stored back to back, with an array of their start offsets.
+
+    An index over a mapped file (see haystack.HaystackIndex) is stored as the place of s in
+    that file, without s and without the automaton arrays. The size and modification time of
+    the file are stored along, and the instance is refused once they changed.
+    """
+
+    # Sections of the buffer, after a header with the start and end offset of each of them
+    SECTIONS = [("s", "B"), ("clauses", "B"), ("clause_start", "i"), ("variables", "B"), ("domain_start", "i"),
+                ("values", "B"), ("value_start", "i"), ("patterns", "B"), ("pattern_start", "i"), ("positions", "i"),
+                ("position_start", "i"), ("source", "B")] + SubstringIndex.ARRAYS
+
+    def __init__(self, buf: memoryview):
+        self.buf = buf
+        self._views = []
+
+        header = self._view(0, 16 * len(self.SECTIONS), "q")
+        sections = {name: self._view(header[2*k], header[2*k+1], typecode) for k, (name, typecode) in enumerate(self.SECTIONS)}
+
+        self.clauses = _split(sections["clauses"], sections["clause_start"])
+        values = _split(sections["values"], sections["value_start"])
+        variables = bytes(sections["variables"]).decode("ascii")
+        domain_start = sections["domain_start"]
+        self.domains = OrderedDict((var, values[domain_start[k]:domain_start[k+1]]) for k, var in enumerate(variables))
+
+        if len(sections["source"]):
+            # s stays in the file it came from, which every process maps for itself
+            filename, start, end, size, mtime = json.loads(bytes(sections["source"]))
+            s = haystack.Haystack.open(filename, start, end)
+            if s.stamp != (size, mtime):
+                raise ValueError("{} changed since the instance was compiled, compile it again".format(filename))
+            self.index = haystack.HaystackIndex(s)
+        elif not len(sections["edge_start"]):
+            # No automaton was built (see haystack.HaystackIndex), s is used in place
+            self.index = haystack.HaystackIndex(haystack.Haystack(sections["s"]))
+        else:
+            s = bytes(sections["s"]).decode("ascii")
+            self.index = SubstringIndex.from_arrays(s, **{name: sections[name] for name, _ in SubstringIndex.ARRAYS})
+
+        positions, position_start = sections["positions"], sections["position_start"]
+        occurrences = {}
+        for k, pattern in enumerate(_split(sections["patterns"], sections["pattern_start"])):
+            occurrences[pattern] = positions[position_start[k]:position_start[k+1]]
+            self._views.append(occurrences[pattern])
+        self.index.seed(occurrences)
+
+    def _view(self, start: int, end: int, typecode: str) -> memoryview:
+        raw = self.buf[start:end]
+        view = raw.cast(typecode)
+        self._views.extend((view, raw))
+        return view
+
+    @classmethod
+    def compile(cls, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> Tuple[array, Dict[str, bytes]]:
+        """Header and contents of the sections of the buffer for an instance, see write"""
+        values = [v for values in rs.values() for v in values]
+        domain_start = array("i", [0])
+        for var_values in rs.values():
+            domain_start.append(domain_start[-1] + len(var_values))
+
+        # Cached already if the index was seeded, otherwise looked up now
+        patterns = ahocorasick.patterns(ts, rs)
+        positions = array("i")
+        position_start = array("i", [0])
+        for pattern in patterns:
+            positions.extend(index.find_all(pattern))
+            position_start.append(len(positions))
+
+        data = {
+            "clauses": "".join(ts).encode("ascii"),
+            "clause_start": _starts(ts).tobytes(),
+            "variables": "".join(rs).encode("ascii"),
+            "domain_start": domain_start.tobytes(),
+            "values": "".join(values).encode("ascii"),
+            "value_start": _starts(values).tobytes(),
+            "patterns": "".join(patterns).encode("ascii"),
+            "pattern_start": _starts(patterns).tobytes(),
+            "positions": positions.tobytes(),
+            "position_start": position_start.tobytes(),
+        }
+        if isinstance(index, haystack.HaystackIndex):
+            data["s"] = data["source"] = b""
+            if index.s.source is not None:
+                data["source"] = json.dumps(index.s.source + index.s.stamp).encode("ascii")
+            else:
+                data["s"] = index.s.buf.tobytes()
+            for name, _ in SubstringIndex.ARRAYS:
+                data[name] = b""
+        else:
+            data["s"] = index.s.encode("ascii")
+            data["source"] = b""
+            for name, _ in SubstringIndex.ARRAYS:
+                data[name] = getattr(index, name).tobytes()
+
+        # Keep every section 8-byte aligned
+        header = array("q")
+        size = 16 * len(cls.SECTIONS)
+        for name, _ in cls.SECTIONS:
+            header.extend((size, size + len(data[name])))
+            size = header[-1] + -header[-1] % 8
+        return header, data
+
+    @classmethod
+    def size(cls, header: array) -> int:
+        return header[-1] + -header[-1] % 8
+
+    @classmethod
+    def write(cls, buf: memoryview, header: array, data: Dict[str, bytes]):
+        """Fill a buffer of at least size(header) bytes with an instance compiled by compile"""
+        buf[:len(header) * 8] = header.tobytes()
+        for k, (name, _) in enumerate(cls.SECTIONS):
+            buf[header[2*k]:header[2*k+1]] = data[name]
+
+    def close(self):
+        """Release the buffer. The index of this instance can no longer be used."""
+        for view in self._views:
+            view.release()
+        self._views.clear()
+
+
+class SharedInstance(CompiledInstance):
+    """
+    Compiled instance (see CompiledInstance) in a multiprocessing.shared_memory block, so that
+    pool workers attach to it by name instead of each getting a copy.
+
+    Tasks then only describe where in the search tree to start (see describe), referring to
+    clauses and replacements by number.
+    """
+
+    def __init__(self, memory: shared_memory.SharedMemory):
+        self.memory = memory
+        super().__init__(memory.buf)
+        self.clause_ids = {t: i for i, t in enumerate(self.clauses)}
+        self.value_ids = {var: {v: i for i, v in enumerate(values)} for var, values in self.domains.items()}
+
+    @classmethod
+    def create(cls, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> "SharedInstance":
+        """Compile an instance into a new block. Whoever creates it must unlink it when done."""
+        header, data = cls.compile(index, ts, rs)
+        memory = shared_memory.SharedMemory(create=True, size=cls.size(header))
+        cls.write(memory.buf, header, data)
+        log.info("Instance compiled into {} bytes of shared memory.".format(cls.size(header)))
+        return cls(memory)
+
+    @classmethod
+    def attach(cls, name: str) -> "SharedInstance":
+        """Attach to a block created (and cleaned up) by another process"""
+        return cls(shared_memory.SharedMemory(name))
+
+    @property
+    def name(self) -> str:
+        return self.memory.name
+
+    def describe(self, ts: List[str], rs: Dict[str, List[str]], expansions: Dict[str, str], positions):
+        """
+        Small description of a starting point of the search: the clauses left (by number, in
+        order), the assigned variables (with the number of their replacement), domains that
+        have been narrowed down and the positions. Undone by task.
+        """
+        order = tuple(self.clause_ids[t] for t in ts)
+        assigned = tuple((var, self.value_ids[var][value]) for var, value in expansions.items() if var.isupper())
+        narrowed = tuple((var, tuple(self.value_ids[var][v] for v in values))
+                         for var, values in rs.items() if len(values) < len(self.domains[var]))
+        return order, assigned, narrowed, positions
+
+    def task(self, description):
+        """Starting point (ts, rs, expansions, positions) described by describe"""
+        order, assigned, narrowed, positions = description
+        ts = [self.clauses[i] for i in order]
+        rs = OrderedDict(self.domains)
+        for var, ids in narrowed:
+            rs[var] = [self.domains[var][i] for i in ids]
+        expansions = {l: l for l in LOWERCASE}
+        for var, i in assigned:
+            expansions[var] = self.domains[var][i]
+        return ts, rs, expansions, positions
+
+    def close(self):
+        """Detach from the block. The index of this instance can no longer be used."""
+        super().close()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+class InstanceFile(CompiledInstance):
+    """
+    Compiled instance (see CompiledInstance) in a file, after a short magic number. Loading it
+    maps the file into memory, so neither s nor its index have to be parsed or built again,
+    and runs on the same file share the pages of the OS cache.
+    """
+
+    MAGIC = b"SWEB\0\0\0\2"
+
+    def __init__(self, f):
+        self.file = f
+        self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(self.MAGIC)] != self.MAGIC:
+            self.map.close()
+            raise ValueError("{} is not a compiled SWE instance".format(f.name))
+        self._buf = memoryview(self.map)
+        try:
+            super().__init__(self._buf[len(self.MAGIC):])
+        except ValueError:
+            self.close()
+            raise
+
+    @classmethod
+    def create(cls, filename: str, index: SubstringIndex, ts: List[str], rs: Dict[str, List[str]]) -> int:
+        """Compile an instance into a file, returning its size"""
+        header, data = cls.compile(index, ts, rs)
+        buf = bytearray(len(cls.MAGIC) + cls.size(header))
+        buf[:len(cls.MAGIC)] = cls.MAGIC
+        cls.write(memoryview(buf)[len(cls.MAGIC):], header, data)
+        with open(filename, "wb") as f:
+            f.write(buf)
+        return len(buf)
+
+    @classmethod
+    def open(cls, filename: str) -> "InstanceFile":
+        return cls(open(filename, "rb"))
+
+    def close(self):
+        """Unmap the file. The index of this instance can no longer be used."""
+        super().close()
+        self.buf.release()
+        self._buf.release()
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import consistency
+
+from index import SubstringIndex
+from typing import Iterable, List, Union
+
+
+class ShiftAnd:
+    """
+    Bit-parallel matcher for a pattern with gaps, after Shift-And (Baeza-Yates & Gonnet, 1992).
+    The pattern is a sequence of pieces: strings, which must occur as they are, and gap
+    lengths, which match any letters.
+
+    Textbook Shift-And moves a bitmask of matched pattern prefixes along s, one letter at a
+    time. Here s is the wide side instead: the occurrences of every piece already are a
+    bitmap over s (see SubstringIndex.bitmap), so shifting each back by its offset in the
+    pattern and and-ing them gives all places the pattern matches, at the cost of one big
+    integer operation per piece.
+    """
+
+    def __init__(self, pieces: Iterable[Union[str, int]]):
+        self.pieces = []
+        self.length = 0
+        for piece in pieces:
+            if isinstance(piece, int):
+                self.length += piece
+            else:
+                self.pieces.append((self.length, piece))
+                self.length += len(piece)
+
+    def __len__(self):
+        return self.length
+
+    def bitmap(self, index: SubstringIndex) -> int:
+        """Bit i is set iff the pattern occurs at position i of s"""
+        if self.length > len(index):
+            return 0
+        result = (1 << (len(index) - self.length + 1)) - 1
+        for offset, piece in self.pieces:
+            result &= index.bitmap(piece) >> offset
+            if not result:
+                break
+        return result
+
+    def find_all(self, index: SubstringIndex) -> List[int]:
+        """All starting positions of the pattern in s, in ascending order"""
+        return list(consistency.bits(self.bitmap(index)))